@@ -0,0 +1,206 @@
+# Timings and peak memory of the ICApp hot paths on synthetic data.
+#
+#   python benchmarks/hot_paths.py --channels 64 128 256 --components 30 \
+#       --epochs 300 --times 500 --json results.json
+#
+# For every (channels, components, epochs, times) combination a synthetic
+# mne.EpochsArray (Laplacian sources mixed into a standard 10-05 montage) and a
+# fitted ICA are built, then the headless paths of ica_app are timed:
+#
+#   init        ICAData.setup_data + load_all (sources, statistics, spectra)
+#   psd         ICASpectra.compute over all components
+#   variance    explained variance + cleaned evoked for random exclude sets
+#   toggle      ICAExcludeState.toggle + the render snapshot
+#   overview    plot_overview rendered with Agg (first build, then a toggle)
+#   component   plot_component rendered with Agg (first build, then a toggle)
+#
+# Each entry reports the median/min wall time over --repeat runs and the peak
+# memory allocated by the path (tracemalloc, numpy buffers included). The JSON
+# output can be diffed between runs or branches.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib
+matplotlib.use('agg')
+import numpy as np
+import mne
+from matplotlib.figure import Figure
+
+import ica_app
+
+mne.set_log_level('warning')
+
+def make_fixture(n_channels, n_components, n_epochs, n_times, sfreq=250., fit_epochs=40, seed=0):
+    rng = np.random.default_rng(seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        montage = mne.channels.make_standard_montage('standard_1005')
+    if n_channels > len(montage.ch_names):
+        raise ValueError(f'at most {len(montage.ch_names)} channels are supported')
+    info = mne.create_info(montage.ch_names[:n_channels], sfreq, 'eeg')
+
+    # Laplacian sources mixed into the sensors, plus a little sensor noise
+    sources = rng.laplace(size=(n_epochs, n_components, n_times))
+    mixing = rng.standard_normal((n_channels, n_components))
+    data = np.einsum('cj,ejt->ect', mixing, sources) * 1e-6
+    data += rng.standard_normal(data.shape) * 1e-7
+    epochs = mne.EpochsArray(data, info, tmin=-0.2, verbose=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        epochs.set_montage(montage)
+        ica = mne.preprocessing.ICA(n_components, method='infomax', max_iter=100, random_state=seed)
+        ica.fit(epochs[:fit_epochs], verbose=False)
+    ica.exclude = [0]
+    return ica, epochs
+
+def make_data(ica, epochs):
+    data = ica_app.ICAData()
+    data.parameters = {
+        'cmap': 'turbo',
+        'psd_xlim': [None, None],
+        'interactive_butterfly': False,
+        'bg_alpha': 1,
+        'overview_avg_xlim': [None, None],
+        'psd_method': 'multitaper',
+        'low_memory': False,
+        'source_dtype': 'float64',
+        'memmap_dir': None,
+        'cache_dir': None,
+        'cache_max_mb': 0,
+        'profile': False,
+        'tfr': False,
+        'tfr_freqs': None,
+        'tfr_decim': None,
+        'tfr_cache_mb': 0,
+        'templates': None,
+        'template_threshold': 0.8,
+    }
+    data.setup_data(ica, epochs.copy())
+    data.load_all()
+    data.setup_style()
+    return data
+
+def measure(func, repeat, setup=None):
+    times, peaks = [], []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        tracemalloc.start()
+        t = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    times.sort()
+    return {
+        'median_ms': 1e3 * times[len(times) // 2],
+        'min_ms': 1e3 * times[0],
+        'peak_mb': max(peaks) / 2**20,
+    }
+
+def run_case(n_channels, n_components, n_epochs, n_times, repeat, size, dpi):
+    t = time.perf_counter()
+    ica, epochs = make_fixture(n_channels, n_components, n_epochs, n_times)
+    fixture_s = time.perf_counter() - t
+    rng = np.random.default_rng(1)
+    data = make_data(ica, epochs)
+    renderer = ica_app.ICAPageRenderer(data)
+    results = {}
+
+    results['init'] = measure(lambda: make_data(ica, epochs), repeat)
+    results['psd'] = measure(lambda: data.spectra.compute(data.source_data), repeat)
+
+    def variance():
+        for _ in range(20):
+            exclude = rng.choice(n_components, size=rng.integers(1, 6), replace=False).tolist()
+            data.variance_engine.explained_variance(exclude)
+            data.variance_engine.explained_variance_with_each(exclude)
+            data.evoked_cache.get_data(exclude)
+    data.evoked_cache.max_size = 0 # time the computation, not the LRU
+    results['variance (20 sets)'] = measure(variance, repeat)
+    data.evoked_cache.max_size = 64
+
+    def toggle():
+        for comp in rng.integers(0, n_components, size=100):
+            data.exclude_state.toggle(comp)
+            data.snapshot()
+    results['toggle (100x)'] = measure(toggle, repeat)
+
+    # Pages: a fresh figure for the first build, then one toggle on the built page
+    def page_setup(page):
+        def setup():
+            data.figure_is_empty[page] = True
+            data.page_versions[page] = None
+            fig = Figure(layout='constrained')
+            renderer.render(fig, page, data.snapshot(), size, dpi)
+            data.exclude_state.toggle(1)
+            return (fig,)
+        return setup
+    for name, page in [('overview', 0), ('component', 2)]:
+        def build(page=page):
+            data.figure_is_empty[page] = True
+            data.page_versions[page] = None
+            renderer.render(Figure(layout='constrained'), page, data.snapshot(), size, dpi)
+        results[name + ' build'] = measure(build, repeat)
+        results[name + ' toggle'] = measure(lambda fig, page=page: renderer.render(fig, page, data.snapshot(), size, dpi),
+                                            repeat, setup=page_setup(page))
+
+    return {
+        'channels': n_channels,
+        'components': n_components,
+        'epochs': n_epochs,
+        'times': n_times,
+        'fixture_s': fixture_s,
+        'source_mb': data.source_data.nbytes / 2**20,
+        'results': results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='ICApp hot path benchmarks')
+    parser.add_argument('--channels', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--components', type=int, nargs='+', default=[30])
+    parser.add_argument('--epochs', type=int, nargs='+', default=[300])
+    parser.add_argument('--times', type=int, nargs='+', default=[500])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--size', type=int, nargs=2, default=[1600, 1000], help='page size in pixels')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    cases = []
+    for n_channels, n_components, n_epochs, n_times in itertools.product(args.channels, args.components,
+                                                                         args.epochs, args.times):
+        case = run_case(n_channels, n_components, n_epochs, n_times, args.repeat, tuple(args.size), args.dpi)
+        cases.append(case)
+        print(f"\n{n_channels} channels, {n_components} components, {n_epochs} epochs x {n_times} samples"
+              f" (sources {case['source_mb']:.0f} MB)")
+        for name, r in case['results'].items():
+            print(f"  {name:<20} {r['median_ms']:10.1f} ms  (min {r['min_ms']:.1f})  peak {r['peak_mb']:8.1f} MB")
+
+    if args.json:
+        output = {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'mne': mne.__version__,
+            'matplotlib': matplotlib.__version__,
+            'repeat': args.repeat,
+            'size': args.size,
+            'dpi': args.dpi,
+            'cases': cases,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Import/startup time of ica_app, measured in fresh interpreters.
+#
+#   python benchmarks/import_time.py [--repeat 7] [--json out.json] [--max-ms 500]
+#
+# Reports the median wall time of `import ica_app` (batch scripts) and of the
+# first GUI use (`import ica_app_qt`), plus which heavy modules the plain import
+# pulled in. With --max-ms the script fails when `import ica_app` gets slower.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ['matplotlib', 'matplotlib.pyplot', 'PyQt5', 'PyQt5.QtWidgets', 'seaborn', 'scipy', 'pandas', 'sklearn']
+
+SNIPPET = '''
+import sys, time, json
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{'seconds': elapsed, 'modules': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def measure(module, repeat):
+    runs = []
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''),
+               QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', SNIPPET.format(module=module, heavy=HEAVY)],
+                             env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    seconds = sorted(run['seconds'] for run in runs)
+    return {
+        'median_ms': 1e3 * seconds[len(seconds) // 2],
+        'min_ms': 1e3 * seconds[0],
+        'max_ms': 1e3 * seconds[-1],
+        'heavy_modules': runs[-1]['modules'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of ica_app')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if `import ica_app` is slower')
+    args = parser.parse_args()
+
+    results = {
+        'python': sys.version.split()[0],
+        'import ica_app': measure('ica_app', args.repeat),
+        'import ica_app_qt': measure('ica_app_qt', args.repeat),
+    }
+    for name in ['import ica_app', 'import ica_app_qt']:
+        r = results[name]
+        print(f"{name:<20} median {r['median_ms']:8.1f} ms  (min {r['min_ms']:.1f}, max {r['max_ms']:.1f})"
+              f"  heavy: {', '.join(r['heavy_modules']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.max_ms is not None and results['import ica_app']['median_ms'] > args.max_ms:
+        print(f"import ica_app is slower than {args.max_ms} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
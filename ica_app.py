@@ -3,64 +3,1626 @@
 # ICA Application for MNE-Python
 
 # %% Imports
+# Only the numeric side is imported here. matplotlib is imported where it is
+# used, and the Qt application lives in ica_app_qt, loaded on first use, so
+# batch scripts that never open the GUI import quickly.
 import mne
 import numpy as np
+import os
 import sys
+import json
+import html
+import time
+import shutil
+import hashlib
+import importlib
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+# %% Profiling
+class ICAProfiler:
+    # Optional instrumentation (ICApp(..., profile=True)): named timing spans,
+    # counters and memory samples, kept as Chrome trace events so they can be
+    # loaded in chrome://tracing or Perfetto. When disabled every call returns
+    # straight away.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events = []
+            self.spans = defaultdict(lambda: [0, 0., 0.]) # name -> [count, total, max]
+            self.counters = defaultdict(int)
+            self.memory = None
+
+    def now(self):
+        return 1e6 * (time.perf_counter() - self.start) # microseconds
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = self.now()
+        try:
+            yield
+        finally:
+            duration = self.now() - start
+            with self.lock:
+                self.events.append({'name': name, 'ph': 'X', 'ts': start, 'dur': duration,
+                                    'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+                stats = self.spans[name]
+                stats[0] += 1
+                stats[1] += duration
+                stats[2] = max(stats[2], duration)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += n
+
+    def sample_memory(self):
+        # Resident set size, from /proc where available
+        if not self.enabled:
+            return
+        try:
+            with open('/proc/self/statm') as f:
+                rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            try:
+                import resource
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            except ImportError:
+                return
+        with self.lock:
+            self.memory = rss
+            self.events.append({'name': 'memory', 'ph': 'C', 'ts': self.now(), 'pid': os.getpid(),
+                                'args': {'rss_mb': rss / 2**20}})
+
+    def summary(self, caches=None):
+        lines = [f"{'span':<28}{'count':>7}{'total ms':>11}{'mean ms':>10}{'max ms':>10}"]
+        with self.lock:
+            for name, (count, total, longest) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+                lines.append(f'{name:<28}{count:>7}{total / 1e3:>11.1f}{total / count / 1e3:>10.1f}{longest / 1e3:>10.1f}')
+            counters = dict(self.counters)
+            memory = self.memory
+        for name, (hits, misses) in (caches or {}).items():
+            counters[name + '.hit'] = hits
+            counters[name + '.miss'] = misses
+        if counters:
+            lines.append('')
+            lines.extend(f'{name:<28}{value:>7}' for name, value in sorted(counters.items()))
+        if memory is not None:
+            lines.append('')
+            lines.append(f"{'rss':<28}{memory / 2**20:>7.0f} MB")
+        return '\n'.join(lines)
+
+    def export(self, path, caches=None):
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        for name, (hits, misses) in (caches or {}).items():
+            counters[name + '.hit'] = hits
+            counters[name + '.miss'] = misses
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': counters}, f)
+
+# %% Numeric Engines
+class ICAReconstruction:
+    # What ica.apply does to the sensors, split so that only the excluded rank
+    # has to be computed: cleaned = reference(X) - mixing[:, E] @ S_E, where
+    # reference is the reconstruction with nothing excluded (identity for a full
+    # rank PCA) and S_E are the excluded sources. Channels the ICA was not fitted
+    # on have zero mixing and pass through.
+    def __init__(self, ica, ch_names):
+        self.ica = ica
+        self.picks = picks = [list(ch_names).index(ch) for ch in ica.ch_names]
+        self.n_components = ica.n_components_
+
+        # Sensor-space mixing matrix (whitened maps scaled back to sensor units)
+        mixing = ica.get_components()
+        if ica.noise_cov is None:
+            mixing = mixing * ica.pre_whitener_
+        else:
+            mixing = np.linalg.pinv(ica.pre_whitener_, rcond=1e-14) @ mixing
+        self.mixing = np.zeros((len(ch_names), self.n_components))
+        self.mixing[picks] = mixing
+
+        # ICA reconstruction drops whatever is outside the kept PCA subspace
+        n_pca = ica._check_n_pca_components(ica.n_pca_components)
+        self.full_rank = n_pca == ica.pca_components_.shape[0] == len(picks)
+        self.pca_projector = ica.pca_components_[:n_pca].T @ ica.pca_components_[:n_pca]
+
+    def reference(self, data):
+        # data: (n_epochs, n_channels, n_times)
+        # Reconstruction with nothing excluded (identity for full rank PCA)
+        if self.full_rank:
+            return data
+        ica = self.ica
+        data = data.copy()
+        x = data[:, self.picks, :]
+        if ica.noise_cov is None:
+            x = x / ica.pre_whitener_
+        else:
+            x = np.einsum('ij,ejt->eit', ica.pre_whitener_, x)
+        mean = 0 if ica.pca_mean_ is None else ica.pca_mean_[:, None]
+        x = np.einsum('ij,ejt->eit', self.pca_projector, x - mean) + mean
+        if ica.noise_cov is None:
+            x = x * ica.pre_whitener_
+        else:
+            x = np.einsum('ij,ejt->eit', np.linalg.pinv(ica.pre_whitener_, rcond=1e-14), x)
+        data[:, self.picks, :] = x
+        return data
+
+    def sources(self, data, exclude):
+        # Only the excluded rows of ica._transform, (n_epochs, len(exclude), n_times)
+        ica = self.ica
+        unmixing = (ica.unmixing_matrix_ @ ica.pca_components_[:self.n_components])[exclude]
+        x = ica._pre_whiten(np.hstack(data[:, self.picks]))
+        if ica.pca_mean_ is not None:
+            x -= ica.pca_mean_[:, None]
+        return (unmixing @ x).reshape(len(exclude), len(data), -1).transpose(1, 0, 2)
+
+    def clean(self, data, exclude, sources=None):
+        # Cleaned copy of data (n_epochs, n_channels, n_times), rank len(exclude) update
+        if len(exclude) and sources is None:
+            sources = self.sources(data, exclude)
+        data = self.reference(data)
+        if len(exclude):
+            data = data - np.einsum('ck,ekt->ect', self.mixing[:, exclude], sources)
+        return data
+
+class ICAVarianceEngine:
+    # The cleaned data is linear in the sources (X - A_E @ S_E), so the residual
+    # power of any exclude set E can be written with second order statistics only:
+    # |Xb - A_E Sb_E|^2 = |Xb|^2 - 2 sum_E(b) + sum_ExE(H)
+    # where Xb/Sb are the baselined data/sources, b_j = a_j . (Xb Sb_j) and
+    # H_ij = (a_i . a_j) (Sb_i . Sb_j). Everything is accumulated block by block,
+    # in the same pass that unmixes the epochs (add_block).
+    def __init__(self, ica, ch_names, times, baseline=True):
+        self.n_components = ica.n_components_
+        self.times = times
+        n_channels = len(ch_names)
+
+        # Sensor-space mixing matrix and reconstruction (see ICAReconstruction)
+        self.reconstruction = ICAReconstruction(ica, ch_names)
+        self.mixing = self.reconstruction.mixing
+        self.picks = self.reconstruction.picks
+        self.reference = self.reconstruction.reference
+
+        # Explained variance is measured on data baselined with (None, 0);
+        # segments of continuous data are not baselined
+        self.baseline_mask = self.times <= 0 if baseline else np.zeros(len(self.times), dtype=bool)
+
+        # Running sums over epoch blocks (see add_block)
+        self.n_epochs = 0
+        self.sums = {
+            'original_power': 0.,
+            'total_power': 0.,
+            'cross': np.zeros((n_channels, self.n_components)),
+            'gram': np.zeros((self.n_components, self.n_components)),
+            'evoked_data': np.zeros((n_channels, len(self.times))),
+            'evoked_sources': np.zeros((self.n_components, len(self.times))),
+            'mean_sources': np.zeros((self.n_components, len(self.times))),
+        }
+        self.min_sources = np.full(self.n_components, np.inf)
+        self.max_sources = np.full(self.n_components, -np.inf)
+
+    def add_block(self, data, sources):
+        # data: (n_epochs, n_channels, n_times), sources: (n_epochs, n_components, n_times)
+        sums = self.sums
+        sources = np.asarray(sources, dtype=float)
+        sums['original_power'] += np.sum(data**2)
+        sums['mean_sources'] += sources.sum(axis=0)
+        self.min_sources = np.minimum(self.min_sources, sources.min(axis=(0, 2)))
+        self.max_sources = np.maximum(self.max_sources, sources.max(axis=(0, 2)))
+
+        data = self.baseline(self.reference(data))
+        sources = self.baseline(sources)
+        sums['total_power'] += np.sum(data**2)
+        sums['cross'] += np.einsum('ect,eit->ci', data, sources)
+        sums['gram'] += np.einsum('eit,ejt->ij', sources, sources)
+        sums['evoked_data'] += data.sum(axis=0)
+        sums['evoked_sources'] += sources.sum(axis=0)
+        self.n_epochs += len(data)
+        self.update()
+
+    def update(self):
+        # Statistics of the epochs added so far
+        sums = self.sums
+        self.nave = self.n_epochs
+        self.original_power = float(sums['original_power'])
+        self.total_power = float(sums['total_power'])
+        self.evoked_data = sums['evoked_data'] / self.nave
+        self.evoked_sources = sums['evoked_sources'] / self.nave
+        self.mean_sources = sums['mean_sources'] / self.nave
+        self.b = np.einsum('ci,ci->i', self.mixing, sums['cross'])
+        self.H = (self.mixing.T @ self.mixing) * sums['gram']
+
+    def baseline(self, data):
+        if not np.any(self.baseline_mask):
+            return data
+        return data - data[..., self.baseline_mask].mean(axis=-1, keepdims=True)
+
+    def residual_power(self, exclude):
+        exclude = np.unique(np.asarray(exclude, dtype=int))
+        return (self.total_power
+                - 2 * np.sum(self.b[exclude])
+                + np.sum(self.H[np.ix_(exclude, exclude)]))
+
+    def explained_variance(self, exclude):
+        # Percentage of the original power left after removing the exclude set
+        return 100 * self.residual_power(exclude) / self.original_power
+
+    def explained_variance_with_each(self, exclude):
+        # Percentage left for (exclude + k), for every component k at once
+        exclude = np.unique(np.asarray(exclude, dtype=int))
+        power = self.residual_power(exclude)
+        added = -2 * self.b + np.diag(self.H) + 2 * np.sum(self.H[exclude], axis=0)
+        added[exclude] = 0
+        return 100 * (power + added) / self.original_power
+
+class ICAExcludeState:
+    # Current exclude set and its running residual statistics. Toggling one
+    # component is a rank-one update of the residual power and of the H column
+    # sums used for "exclude + k", so it costs O(n_components). The sums hold
+    # for the epochs loaded at the last reset(); while more blocks come in the
+    # percentages are taken from the engine directly.
+    def __init__(self, engine, exclude=()):
+        self.engine = engine
+        self.excluded = np.zeros(engine.n_components, dtype=bool)
+        self.excluded[np.asarray(exclude, dtype=int)] = True
+        self.version = 0
+        self.reset()
+
+    def reset(self):
+        # Recompute the running sums, e.g. after the engine statistics changed
+        excluded = self.excluded.copy()
+        self.excluded[:] = False
+        self.n_epochs = self.engine.n_epochs
+        self.power = self.engine.total_power
+        self.column_sum = np.zeros(self.engine.n_components) # sum of H[:, E]
+        for comp in np.flatnonzero(excluded):
+            self.toggle(comp)
+
+    @property
+    def exclude(self):
+        return np.flatnonzero(self.excluded).tolist()
+
+    def added_power(self, comp):
+        return -2 * self.engine.b[comp] + self.engine.H[comp, comp] + 2 * self.column_sum[comp]
+
+    def toggle(self, comp):
+        if self.excluded[comp]:
+            self.excluded[comp] = False
+            self.column_sum -= self.engine.H[:, comp]
+            self.power -= self.added_power(comp)
+        else:
+            self.power += self.added_power(comp)
+            self.column_sum += self.engine.H[:, comp]
+            self.excluded[comp] = True
+        self.version += 1
+
+    def set_excluded(self, comps, excluded):
+        # Bulk move, the rank-k version of toggle. Returns the components whose
+        # state changed.
+        comps = np.unique(np.asarray(comps, dtype=int))
+        comps = comps[self.excluded[comps] != excluded]
+        if not len(comps):
+            return comps
+        b = np.sum(self.engine.b[comps])
+        block = np.sum(self.engine.H[np.ix_(comps, comps)])
+        columns = self.engine.H[:, comps].sum(axis=1)
+        if excluded:
+            self.power += -2 * b + block + 2 * np.sum(self.column_sum[comps])
+            self.column_sum += columns
+        else:
+            self.power += 2 * b + block - 2 * np.sum(self.column_sum[comps])
+            self.column_sum -= columns
+        self.excluded[comps] = excluded
+        self.version += 1
+        return comps
+
+    @property
+    def current(self):
+        return self.n_epochs == self.engine.n_epochs
+
+    def explained_variance(self):
+        if not self.current:
+            return self.engine.explained_variance(self.exclude)
+        return 100 * self.power / self.engine.original_power
+
+    def explained_variance_with_each(self):
+        if not self.current:
+            return self.engine.explained_variance_with_each(self.exclude)
+        added = -2 * self.engine.b + np.diag(self.engine.H) + 2 * self.column_sum
+        added[self.excluded] = 0
+        return 100 * (self.power + added) / self.engine.original_power
+
+class ICAEvokedCache:
+    # Averaging and ICA reconstruction commute, so the evoked of the cleaned
+    # dataset is evoked(X) - A_E @ evoked(S_E). Results are kept per exclude set
+    # with LRU eviction.
+    def __init__(self, engine, max_size=64):
+        self.engine = engine
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_data(self, exclude):
+        key = tuple(np.unique(np.asarray(exclude, dtype=int)).tolist())
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses += 1
+
+        exclude = list(key)
+        data = self.engine.evoked_data - self.engine.mixing[:, exclude] @ self.engine.evoked_sources[exclude]
+        with self.lock:
+            self.cache[key] = data
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+class ICASpectra:
+    # Mean log-power spectrum of every component, shape (n_components, n_freqs).
+    # The DPSS tapers are computed once and the FFT runs over all epochs and
+    # components of a chunk at once.
+    def __init__(self, sfreq, n_times, psd_xlim, method='multitaper'):
+        f1, f2 = psd_xlim
+        if f1 is None:
+            f1 = 1
+        if f2 is None:
+            f2 = 50
+        self.sfreq = sfreq
+        self.n_times = n_times
+        self.method = method
+        self.key = (f1, f2, method)
+
+        if method == 'multitaper':
+            self.tapers, eigvals = mne.time_frequency.dpss_windows(n_times, 4.0, 8, sym=False, low_bias=True)
+            self.bandwidth = 4.0 * sfreq / n_times # half bandwidth (Hz)
+            self.weights = np.sqrt(eigvals)[:, None]
+            freqs = np.fft.rfftfreq(n_times, 1. / sfreq)
+        elif method == 'welch':
+            self.n_fft = min(n_times, 256)
+            self.bandwidth = 2 * sfreq / self.n_fft # Hann main lobe
+            freqs = np.fft.rfftfreq(self.n_fft, 1. / sfreq)
+        else:
+            raise ValueError(f"psd_method must be 'multitaper' or 'welch', got {method!r}")
+        self.freq_mask = (freqs >= f1) & (freqs <= f2)
+        self.freqs = freqs[self.freq_mask]
+
+    def psd(self, data):
+        # data: (..., n_times) -> (..., n_freqs)
+        if self.method == 'welch':
+            psd, _ = mne.time_frequency.psd_array_welch(data, self.sfreq,
+                                                        fmin=self.key[0], fmax=self.key[1],
+                                                        n_fft=self.n_fft, window='hann', verbose=False)
+            return psd
+        data = data - data.mean(axis=-1, keepdims=True)
+        x_mt = np.fft.rfft(data[..., None, :] * self.tapers, axis=-1)
+        x_mt[..., 0] /= np.sqrt(2.)
+        if self.n_times % 2 == 0:
+            x_mt[..., -1] /= np.sqrt(2.)
+        x_mt = x_mt[..., self.freq_mask]
+        psd = np.sum(np.abs(self.weights * x_mt)**2, axis=-2)
+        return psd * 2 / np.sum(self.weights**2)
+
+    def log_sum(self, source_data, chunk_size=16):
+        # Sum of 10*log10(PSD) across epochs, for all components
+        spec = np.zeros((source_data.shape[1], len(self.freqs)))
+        for start in range(0, source_data.shape[0], chunk_size):
+            data = np.asarray(source_data[start:start + chunk_size], dtype=float)
+            spec += np.sum(10 * np.log10(self.psd(data)), axis=0)
+        return spec
+
+    def compute(self, source_data, chunk_size=16):
+        # Average of 10*log10(PSD) across epochs, for all components
+        return self.log_sum(source_data, chunk_size) / source_data.shape[0]
+
+class ICATimeFrequency:
+    # ERSP and ITC of one component over all trials, with Morlet wavelets. The
+    # trials are transformed once and convolved with every wavelet in the
+    # frequency domain, all trials at once (the same numbers as
+    # mne.time_frequency.tfr_array_morlet), then decimated. Results are kept per
+    # component as float32 with LRU eviction above max_bytes.
+    def __init__(self, sfreq, times, freqs=None, decim=None, max_bytes=128 * 2**20):
+        n_times = len(times)
+        if freqs is None: # the 3-cycle wavelet fits in an epoch, up to low gamma
+            fmax = min(45., sfreq / 3)
+            freqs = np.geomspace(min(5 * sfreq / n_times, fmax / 2), fmax, 24)
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.n_cycles = np.maximum(self.freqs / 2, 3)
+        self.decim = max(1, n_times // 150) if decim is None else int(decim)
+        self.times = times[::self.decim]
+
+        # ERSP in dB relative to the pre-stimulus power (the whole epoch if none)
+        self.baseline_mask = self.times < 0
+        if not np.any(self.baseline_mask):
+            self.baseline_mask[:] = True
+
+        # Wavelets in the frequency domain, zero padded for a linear convolution
+        from mne.time_frequency import morlet
+        wavelets = morlet(sfreq, self.freqs, self.n_cycles, zero_mean=True)
+        self.n_fft = 1 << int(np.ceil(np.log2(n_times + max(len(w) for w in wavelets) - 1)))
+        self.wavelet_fft = np.array([np.fft.fft(w, self.n_fft) for w in wavelets])
+        self.offsets = [(len(w) - 1) // 2 for w in wavelets] # start of the centred part
+        self.n_times = n_times
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def compute(self, data):
+        # data: (n_epochs, n_times) -> ERSP (dB), ITC, each (n_freqs, n_decimated_times)
+        spectrum = np.fft.fft(np.asarray(data, dtype=float), self.n_fft, axis=-1)
+        power = np.empty((len(self.freqs), len(self.times)))
+        itc = np.empty_like(power)
+        for i, (wavelet, offset) in enumerate(zip(self.wavelet_fft, self.offsets)):
+            tfr = np.fft.ifft(spectrum * wavelet, axis=-1)[:, offset:offset + self.n_times:self.decim]
+            amplitude = np.abs(tfr)
+            power[i] = np.mean(amplitude**2, axis=0)
+            itc[i] = np.abs(np.mean(tfr / np.maximum(amplitude, np.finfo(float).tiny), axis=0))
+        reference = power[:, self.baseline_mask].mean(axis=1, keepdims=True)
+        ersp = 10 * np.log10(power / reference)
+        return ersp.astype(np.float32), itc.astype(np.float32)
+
+    def get(self, comp):
+        with self.lock:
+            if comp in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(comp)
+                return self.cache[comp]
+            self.misses += 1
+        return None
+
+    def put(self, comp, result):
+        with self.lock:
+            if comp in self.cache:
+                return
+            self.cache[comp] = result
+            self.nbytes += sum(array.nbytes for array in result)
+            while self.nbytes > self.max_bytes and self.cache:
+                _, evicted = self.cache.popitem(last=False)
+                self.nbytes -= sum(array.nbytes for array in evicted)
+
+    def ready(self, comp):
+        with self.lock:
+            return comp in self.cache
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.nbytes = 0
+
+class ICAMetrics:
+    # Per-component artifact metrics for the component table. Everything comes
+    # from running sums filled in the same pass as the other statistics: raw
+    # moments of the sources (kurtosis), products with the EOG/ECG channels
+    # (correlation), plus the mean spectra and the variance engine.
+    descriptions = OrderedDict([
+        ('Var. (%)', 'Variance of the dataset removed by this component alone'),
+        ('Kurtosis', 'Excess kurtosis of the component activity (peaky artifacts score high)'),
+        ('Low/High (dB)', 'Power ratio between 1-7 Hz and 8-30 Hz'),
+        ('Line (dB)', 'Power at the line frequency relative to the neighbouring frequencies'),
+        ('EOG r', 'Strongest correlation with an EOG channel'),
+        ('ECG r', 'Strongest correlation with an ECG channel'),
+    ])
+
+    def __init__(self, n_components, artifact_info=None):
+        self.n_components = n_components
+        self.channel_types = []
+        if artifact_info is not None:
+            self.channel_types = np.array(artifact_info.get_channel_types())
+        n_ref = len(self.channel_types)
+        self.sums = {
+            'n_samples': 0.,
+            'moments': np.zeros((4, n_components)), # sum of s, s^2, s^3, s^4
+            'ref_sum': np.zeros(n_ref),
+            'ref_power': np.zeros(n_ref),
+            'ref_cross': np.zeros((n_components, n_ref)),
+        }
 
-# Plots
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib.gridspec as gridspec
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-import seaborn as sns
-sns.set_theme('paper', 'whitegrid', 'dark')
-
-# Qt5 Imports
-from PyQt5 import QtGui
-from PyQt5.QtWidgets import QApplication, QWidget, QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QStackedWidget, QLabel, QListWidget, QListWidgetItem, QLineEdit, QShortcut, QFileDialog
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-
-# %% Applications Classes
-qt_app = None # Global variable to store the Qt Application
-class ICAWorkerThread(QThread):
-    finished_signal = pyqtSignal(dict)
-
-    def __init__(self, app):
-        super().__init__()
-        self.app = app
+    def add_block(self, sources, reference=None):
+        # sources: (n_epochs, n_components, n_times), reference: (n_epochs, n_ref, n_times)
+        sums = self.sums
+        sources = np.asarray(sources, dtype=float)
+        power = sources**2
+        sums['n_samples'] += sources.shape[0] * sources.shape[2]
+        sums['moments'] += np.stack([sources.sum(axis=(0, 2)),
+                                     power.sum(axis=(0, 2)),
+                                     (power * sources).sum(axis=(0, 2)),
+                                     (power**2).sum(axis=(0, 2))])
+        if reference is not None and len(self.channel_types):
+            sums['ref_sum'] += reference.sum(axis=(0, 2))
+            sums['ref_power'] += np.sum(reference**2, axis=(0, 2))
+            sums['ref_cross'] += np.einsum('eit,ect->ic', sources, reference)
+
+    def kurtosis(self):
+        n = float(self.sums['n_samples'])
+        m1, m2, m3, m4 = self.sums['moments'] / n
+        var = m2 - m1**2
+        central4 = m4 - 4 * m1 * m3 + 6 * m1**2 * m2 - 3 * m1**4
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return central4 / var**2 - 3
+
+    def correlation(self, ch_type):
+        columns = np.flatnonzero(self.channel_types == ch_type)
+        if not len(columns):
+            return None
+        sums = self.sums
+        n = float(sums['n_samples'])
+        mean_s = sums['moments'][0] / n
+        mean_r = sums['ref_sum'][columns] / n
+        cov = sums['ref_cross'][:, columns] / n - np.outer(mean_s, mean_r)
+        var_s = sums['moments'][1] / n - mean_s**2
+        var_r = sums['ref_power'][columns] / n - mean_r**2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = cov / np.sqrt(np.outer(var_s, var_r))
+        strongest = np.argmax(np.abs(np.nan_to_num(r)), axis=1)
+        return r[np.arange(self.n_components), strongest]
+
+    @staticmethod
+    def band_power(freqs, power, *bands):
+        # Mean power over the union of the (f1, f2) bands, NaN if none is displayed
+        mask = np.zeros(len(freqs), dtype=bool)
+        for f1, f2 in bands:
+            mask |= (freqs >= f1) & (freqs <= f2)
+        if not np.any(mask):
+            return np.full(len(power), np.nan)
+        return power[:, mask].mean(axis=1)
+
+    def compute(self, engine, spectra, spectra_mean, line_freq=None):
+        # Band ratios use the displayed spectra, so bands outside psd_xlim are NaN.
+        # The line peak is as wide as the spectral resolution, its flanks lie
+        # just outside of it.
+        metrics = OrderedDict()
+        metrics['Var. (%)'] = 100 * (2 * engine.b - np.diag(engine.H)) / engine.original_power
+        metrics['Kurtosis'] = self.kurtosis()
+
+        freqs = spectra.freqs
+        power = 10**(spectra_mean / 10)
+        line_freq = 50. if line_freq is None else line_freq
+        width = max(1., spectra.bandwidth)
+        low = self.band_power(freqs, power, (1, 7))
+        high = self.band_power(freqs, power, (8, 30))
+        line = self.band_power(freqs, power, (line_freq - width, line_freq + width))
+        flanks = self.band_power(freqs, power, (line_freq - 3 * width, line_freq - 1.5 * width),
+                                 (line_freq + 1.5 * width, line_freq + 3 * width))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            metrics['Low/High (dB)'] = 10 * np.log10(low / high)
+            metrics['Line (dB)'] = 10 * np.log10(line / flanks)
+
+        for ch_type in ['eog', 'ecg']:
+            r = self.correlation(ch_type)
+            if r is not None:
+                metrics[ch_type.upper() + ' r'] = r
+        return metrics
+
+class ICASegmentSummary:
+    # Continuous data is reviewed as fixed-length segments, but the sources of
+    # the whole recording are not kept. Per segment only an RMS envelope
+    # (n_bins per segment, what the component pages show instead of the trial
+    # image) is stored, plus the segment where each component is strongest.
+    def __init__(self, n_components, n_times, n_bins=50):
+        self.n_bins = min(n_bins, n_times)
+        self.edges = np.linspace(0, n_times, self.n_bins + 1).astype(int)
+        self.arrays = {
+            'peak_rms': np.zeros(n_components),
+            'peak_segment': np.zeros(n_components, dtype=int),
+            'peak_sources': np.zeros((n_components, n_times)),
+            'max_envelope': np.zeros(n_components),
+        }
 
-    def run(self):
-        # Get Index
-        index = self.app.stacked_widget.currentIndex()
-        # print(f'Running thread ({index})')
+    def envelope(self, sources):
+        # (n_segments, n_components, n_times) -> (n_segments, n_components, n_bins)
+        power = np.add.reduceat(np.asarray(sources, dtype=float)**2, self.edges[:-1], axis=2)
+        return np.sqrt(power / np.diff(self.edges))
+
+    def add_block(self, sources, start):
+        arrays = self.arrays
+        sources = np.asarray(sources, dtype=float)
+        rms = np.sqrt(np.mean(sources**2, axis=2)) # (n_segments, n_components)
+        best = rms.argmax(axis=0)
+        comps = np.arange(sources.shape[1])
+        better = rms[best, comps] > arrays['peak_rms']
+        arrays['peak_rms'][better] = rms[best, comps][better]
+        arrays['peak_segment'][better] = start + best[better]
+        arrays['peak_sources'][better] = sources[best[better], comps[better]]
+        envelope = self.envelope(sources)
+        arrays['max_envelope'] = np.maximum(arrays['max_envelope'], envelope.max(axis=(0, 2)))
+        return envelope
+
+class ICASourceChunks:
+    # Sources of a continuous recording computed on demand, in fixed-size chunks
+    # kept in an LRU cache. Only what is being looked at (plus a prefetch
+    # margin) is ever read and unmixed.
+    def __init__(self, ica, raw, chunk_duration=10., max_chunks=64):
+        self.ica = ica
+        self.raw = raw
+        self.picks = [raw.ch_names.index(ch) for ch in ica.ch_names]
+        self.sfreq = raw.info['sfreq']
+        self.chunk_size = max(1, int(round(chunk_duration * self.sfreq)))
+        self.n_times = raw.n_times
+        self.max_chunks = max_chunks
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def chunk(self, index):
+        with self.lock:
+            if index in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(index)
+                return self.cache[index]
+            self.misses += 1
+        start = index * self.chunk_size
+        stop = min(self.n_times, start + self.chunk_size)
+        with self.read_lock: # one reader on the file at a time
+            data = self.raw.get_data(picks=self.picks, start=start, stop=stop)
+        sources = self.ica._transform(data)
+        with self.lock:
+            self.cache[index] = sources
+            while len(self.cache) > self.max_chunks:
+                self.cache.popitem(last=False)
+        return sources
+
+    def get(self, start, stop):
+        # Sources between two samples, shape (n_components, stop - start)
+        start, stop = max(0, start), min(self.n_times, stop)
+        first, last = start // self.chunk_size, (stop - 1) // self.chunk_size
+        data = np.concatenate([self.chunk(index) for index in range(first, last + 1)], axis=1)
+        offset = first * self.chunk_size
+        return data[:, start - offset:stop - offset]
+
+    def prefetch(self, start, stop):
+        start, stop = max(0, start), min(self.n_times, stop)
+        for index in range(start // self.chunk_size, (stop - 1) // self.chunk_size + 1):
+            self.chunk(index)
+
+class TopomapInterpolator:
+    # Sensor positions -> image grid weights for one montage, using the same
+    # geometry as mne.viz.plot_topomap (cubic interpolation, extrapolated to the
+    # head with border='mean'). Once built, any set of maps is one matrix product.
+    def __init__(self, info, res=64):
+        from mne.channels.layout import _find_topomap_coords
+        from mne.utils.check import _check_sphere
+        from mne.viz.topomap import _make_head_outlines, _setup_interp
+
+        sphere = _check_sphere(None, info)
+        self.pos = _find_topomap_coords(info, picks=np.arange(len(info.ch_names)), sphere=sphere)
+        self.outlines = _make_head_outlines(sphere, self.pos, 'head', (0., 0.))
+        self.extent, Xi, Yi, interp = _setup_interp(self.pos, res, 'cubic', 'head', self.outlines, 'mean')
+
+        # Extra border points take the mean of their sensor neighbours
+        n_channels = len(self.pos)
+        extra = np.zeros((interp.n_extra, n_channels))
+        indices, indptr = interp.tri.vertex_neighbor_vertices
+        for idx in range(interp.n_extra):
+            ngb = indptr[indices[n_channels + idx]:indices[n_channels + idx + 1]]
+            ngb = ngb[ngb < n_channels]
+            if len(ngb) > 0:
+                extra[idx, ngb] = 1. / len(ngb)
+        used = np.any(extra, axis=1)
+        if not used.all() and used.any():
+            extra[~used] = extra[used].mean(axis=0)
+
+        # Interpolating the identity gives the weight of every sensor on every pixel
+        values = np.concatenate((np.eye(n_channels), extra))
+        weights = interp.interp(interp.tri, values)(Xi, Yi)
+        self.shape = Xi.shape
+        self.grid = (Xi, Yi)
+        self.weights = weights.reshape(-1, n_channels)
+
+    def images(self, maps):
+        # maps: (n_channels, n_maps) -> (n_maps, res, res)
+        return (self.weights @ maps).T.reshape(-1, *self.shape)
+
+    def plot(self, ax, image, vlim, cmap):
+        from matplotlib.patches import Ellipse
+        from mne.viz.topomap import _draw_outlines
+
+        im = ax.imshow(image, cmap=cmap, origin='lower', aspect='equal',
+                       extent=self.extent, interpolation='bilinear',
+                       vmin=-vlim, vmax=vlim)
+        clip_radius = self.outlines['clip_radius']
+        clip_origin = self.outlines.get('clip_origin', (0., 0.))
+        patch = Ellipse(clip_origin, 2 * clip_radius[0], 2 * clip_radius[1],
+                        clip_on=True, transform=ax.transData)
+        im.set_clip_path(patch)
+        if np.nanmax(image) > np.nanmin(image):
+            cont = ax.contour(*self.grid, image, 6, colors='k', linewidths=0.5)
+            cont.set_clip_path(patch)
+        _draw_outlines(ax, self.outlines)
+        ax.scatter(self.pos[:, 0], self.pos[:, 1], s=0.25, c='k', marker='o')
+        ax.set_axis_off()
+        return im
+
+class TrialImageLOD:
+    # Pools the (n_epochs, n_times) activity of a component down to the canvas
+    # resolution with block means, so imshow never holds more pixels than it can
+    # show. Pooled images are cached per component, resolution and view.
+    def __init__(self, source_data, max_size=64):
+        self.source_data = source_data
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def pool(self, data, n, axis):
+        edges = np.linspace(0, data.shape[axis], n + 1).astype(int)
+        counts = np.diff(edges)
+        shape = [1, 1]
+        shape[axis] = n
+        return np.add.reduceat(data, edges[:-1], axis=axis) / counts.reshape(shape)
+
+    def get(self, comp, shape, view=None):
+        n_epochs, _, n_times = self.source_data.shape
+        e0, e1, t0, t1 = (0, n_epochs, 0, n_times) if view is None else view
+        rows = max(1, min(shape[0], e1 - e0))
+        cols = max(1, min(shape[1], t1 - t0))
+        key = (comp, rows, cols, e0, e1, t0, t1)
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses += 1
+
+        data = np.asarray(self.source_data[e0:e1, comp, t0:t1], dtype=float)
+        if rows < e1 - e0:
+            data = self.pool(data, rows, 0)
+        if cols < t1 - t0:
+            data = self.pool(data, cols, 1)
+        with self.lock:
+            self.cache[key] = data
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+class ICADiskCache:
+    # Content-addressed store of what one pass over the epochs produces (sources,
+    # running sums, spectra), so reopening a subject skips that pass. Entries are
+    # directories named after a hash of the ICA, an epoch data fingerprint and
+    # the parameters that change the numbers. The least recently used entries
+    # are removed once the directory grows past max_bytes.
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, ica, epochs, parameters, picks, artifact_picks=()):
+        h = hashlib.sha1()
+        def add(value):
+            if isinstance(value, np.ndarray):
+                h.update(str((value.dtype.str, value.shape)).encode())
+                h.update(np.ascontiguousarray(value).tobytes())
+            else:
+                h.update(repr(value).encode())
+
+        # ICA
+        for name in ['unmixing_matrix_', 'pca_components_', 'pca_mean_', 'pre_whitener_']:
+            add(getattr(ica, name))
+        add((ica.n_components_, ica.n_pca_components, list(ica.ch_names)))
+
+        # Epochs: layout, events and a sample of the (baselined) data
+        n_epochs = len(epochs)
+        sample = sorted({0, n_epochs // 2, n_epochs - 1})
+        add((n_epochs, [epochs.ch_names[pick] for pick in picks], epochs.info['sfreq'], epochs.tmin,
+             len(epochs.times)))
+        add(epochs.events)
+        add(epochs.get_data(picks=picks, item=sample, verbose=False))
+        if len(artifact_picks): # EOG/ECG channels of the metrics
+            add([epochs.ch_names[pick] for pick in artifact_picks])
+            add(epochs.get_data(picks=artifact_picks, item=sample, verbose=False))
+        else:
+            add(None)
+
+        # Parameters
+        add([(name, parameters[name]) for name in ['psd_xlim', 'psd_method', 'source_dtype']])
+        if parameters['psd_method'] == 'welch':
+            add('hann') # entries from before the Welch window was fixed to Hann
+        return h.hexdigest()
+
+    def load(self, key):
+        entry = os.path.join(self.path, key)
+        if not os.path.exists(os.path.join(entry, 'meta.json')):
+            self.misses += 1
+            return None
+        try:
+            with np.load(os.path.join(entry, 'stats.npz')) as f:
+                arrays = dict(f)
+            arrays['source_data'] = np.load(os.path.join(entry, 'sources.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            self.misses += 1
+            return None
+        os.utime(os.path.join(entry, 'meta.json')) # recently used
+        self.hits += 1
+        return arrays
+
+    def save(self, key, source_data, arrays):
+        entry = os.path.join(self.path, key)
+        if os.path.exists(entry):
+            return
+        tmp = tempfile.mkdtemp(prefix=key + '.tmp-', dir=self.path)
+        try:
+            np.save(os.path.join(tmp, 'sources.npy'), source_data)
+            np.savez(os.path.join(tmp, 'stats.npz'), **arrays)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'created': time.time(), 'shape': list(source_data.shape)}, f)
+            os.rename(tmp, entry) # complete entries only
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            meta = os.path.join(entry, 'meta.json')
+            if not os.path.isdir(entry) or not os.path.exists(meta):
+                continue # unfinished (or foreign) directories are left alone
+            size = sum(f.stat().st_size for f in os.scandir(entry))
+            entries.append((os.path.getmtime(meta), name, size))
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            total -= size
+
+class ICADecisionJournal:
+    # Append-only record of the Remove/Restore decisions, one JSON line per move,
+    # in <path>/<fingerprint>.jsonl where the fingerprint is a hash of the fitted
+    # ICA (not of its exclude list). Reopening the same ICA with the exclude list
+    # the session was opened with replays it, so neither a crash nor a kernel
+    # that dies before the ICA is saved loses anything. Once the ICA is written
+    # (saved()) the file is removed and the journal starts over from there.
+    # compact() rewrites it as one snapshot line (atomically); that happens on
+    # open and every compact_every records.
+    def __init__(self, path, fingerprint, n_components, compact_every=256):
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, fingerprint + '.jsonl')
+        self.n_components = n_components
+        self.compact_every = compact_every
+        self.exclude = None
+        self.opened = None # exclude list the session started from
+        self.n_records = 0
+
+    @staticmethod
+    def fingerprint(ica):
+        h = hashlib.sha1()
+        for name in ['unmixing_matrix_', 'pca_components_', 'pca_mean_', 'pre_whitener_']:
+            value = getattr(ica, name)
+            h.update(repr(None).encode() if value is None else np.ascontiguousarray(value).tobytes())
+        h.update(repr((ica.n_components_, list(ica.ch_names))).encode())
+        return h.hexdigest()
+
+    def replay(self):
+        # Exclude list left by the journal, or None without one. A torn last line
+        # (crash while writing) is skipped.
+        exclude = None
+        self.opened = None
+        self.n_records = 0
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'exclude' in record: # snapshot, every journal starts with one
+                        exclude = set(record['exclude'])
+                        self.opened = record.get('opened')
+                    elif exclude is not None:
+                        exclude |= set(record.get('remove', []))
+                        exclude -= set(record.get('restore', []))
+                    self.n_records += 1
+        if exclude is None:
+            return None
+        return sorted(comp for comp in exclude if 0 <= comp < self.n_components)
+
+    def start(self, exclude, opened):
+        # The journal continues from this exclude list
+        self.exclude = set(int(comp) for comp in exclude)
+        self.opened = [int(comp) for comp in opened]
+        self.compact()
+
+    def append(self, comps, excluded):
+        comps = [int(comp) for comp in comps]
+        if excluded:
+            self.exclude |= set(comps)
+        else:
+            self.exclude -= set(comps)
+        if not os.path.exists(self.path): # first move since saved()
+            self.compact()
+            return
+        record = {'t': round(time.time(), 3), 'remove' if excluded else 'restore': comps}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.n_records += 1
+        if self.n_records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'t': round(time.time(), 3), 'opened': self.opened,
+                                'exclude': sorted(self.exclude)}) + '\n')
+        os.replace(tmp, self.path)
+        self.n_records = 1
+
+    def saved(self, exclude):
+        # The ICA was written with this exclude list, which is what a reopened
+        # session starts from now
+        self.exclude = set(int(comp) for comp in exclude)
+        self.opened = sorted(self.exclude)
+        ICAData.remove_file(self.path)
+
+class ICATemplateLibrary:
+    # Components labelled in earlier reviews ("blink", "heartbeat", ...) kept in
+    # one .npz: float32 topographies over the library channels, the log spectra
+    # when they were known, labels and whether they were removed. A subject is
+    # matched with a single product of the z-scored templates and components
+    # (on the channels they share), the best template of each label is taken,
+    # and linear_sum_assignment gives every label at most one component.
+    def __init__(self, path=None):
+        self.path = path
+        self.ch_names = []
+        self.maps = np.zeros((0, 0), dtype=np.float32)
+        self.freqs = None
+        self.spectra = None # NaN rows for templates added without a spectrum
+        self.labels = []
+        self.excluded = np.zeros(0, dtype=bool)
+        self.sources = []
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def load(self, path):
+        with np.load(path, allow_pickle=False) as f:
+            self.ch_names = f['ch_names'].tolist()
+            self.maps = f['maps']
+            self.labels = f['labels'].tolist()
+            self.excluded = f['excluded']
+            self.sources = f['sources'].tolist()
+            if 'freqs' in f:
+                self.freqs = f['freqs']
+                self.spectra = f['spectra']
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        self.path = path
+        arrays = {
+            'ch_names': np.array(self.ch_names, dtype=str),
+            'maps': self.maps,
+            'labels': np.array(self.labels, dtype=str),
+            'excluded': self.excluded,
+            'sources': np.array(self.sources, dtype=str),
+        }
+        if self.freqs is not None:
+            arrays.update(freqs=self.freqs, spectra=self.spectra)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path) # never a half written library
+
+    @staticmethod
+    def zscore(x, axis=-1):
+        x = x - x.mean(axis=axis, keepdims=True)
+        std = x.std(axis=axis, keepdims=True)
+        return x / np.where(std > 0, std, 1)
+
+    def resample_spectra(self, spectra, freqs):
+        # (n, len(freqs)) -> (n, len(self.freqs)); NaN outside the given range
+        spectra = np.asarray(spectra, dtype=float)
+        inside = (self.freqs >= freqs[0]) & (self.freqs <= freqs[-1])
+        out = np.full((len(spectra), len(self.freqs)), np.nan)
+        out[:, inside] = np.array([np.interp(self.freqs[inside], freqs, row) for row in spectra])
+        return out
+
+    def add(self, maps, ch_names, label, excluded=True, spectra=None, freqs=None, source=''):
+        # maps: (n_channels, n) topographies (ica.get_components() columns),
+        # spectra: optional (n, n_freqs) log power
+        maps = np.atleast_2d(np.asarray(maps, dtype=float).T) # (n, n_channels)
+        if not len(self):
+            self.ch_names = list(ch_names)
+            self.maps = np.zeros((0, len(ch_names)), dtype=np.float32)
+        rows = np.zeros((len(maps), len(self.ch_names)), dtype=np.float32)
+        shared = [ch for ch in ch_names if ch in self.ch_names]
+        rows[:, [self.ch_names.index(ch) for ch in shared]] = maps[:, [list(ch_names).index(ch) for ch in shared]]
+        self.maps = np.vstack([self.maps, rows])
+
+        if spectra is not None and self.freqs is None:
+            self.freqs = np.asarray(freqs, dtype=float)
+            self.spectra = np.full((len(self.labels), len(self.freqs)), np.nan, dtype=np.float32)
+        if self.freqs is not None:
+            rows = np.full((len(maps), len(self.freqs)), np.nan, dtype=np.float32)
+            if spectra is not None:
+                rows[:] = self.resample_spectra(np.atleast_2d(spectra), np.asarray(freqs, dtype=float))
+            self.spectra = np.vstack([self.spectra, rows])
+
+        self.labels += [label] * len(maps)
+        self.excluded = np.concatenate([self.excluded, np.full(len(maps), bool(excluded))])
+        self.sources += [source] * len(maps)
+
+    def add_ica(self, ica, comps, label, excluded=True, spectra=None, freqs=None, source=''):
+        self.add(ica.get_components()[:, comps], ica.ch_names, label, excluded,
+                 None if spectra is None else np.asarray(spectra)[comps], freqs, source)
+
+    def scores(self, maps, ch_names, spectra=None, freqs=None, spectra_weight=0.3):
+        # (n_templates, n_components) similarity: |correlation| of the
+        # topographies (ICA signs are arbitrary), blended with the correlation of
+        # the log spectra where both are known
+        index = {ch: i for i, ch in enumerate(ch_names)}
+        shared = [ch for ch in self.ch_names if ch in index]
+        templates = self.zscore(self.maps[:, [self.ch_names.index(ch) for ch in shared]].astype(float))
+        components = self.zscore(np.asarray(maps, dtype=float)[[index[ch] for ch in shared]].T)
+        scores = np.abs(templates @ components.T) / max(len(shared), 1)
+        if spectra is not None and self.spectra is not None and spectra_weight > 0:
+            spectra = self.resample_spectra(spectra, np.asarray(freqs, dtype=float))
+            columns = ~np.isnan(spectra).any(axis=0) # frequencies both sides cover
+            known = ~np.isnan(self.spectra[:, columns]).any(axis=1)
+            if known.any() and columns.sum() > 2:
+                similarity = self.zscore(self.spectra[known][:, columns].astype(float)) @ \
+                             self.zscore(spectra[:, columns]).T / columns.sum()
+                scores[known] = (1 - spectra_weight) * scores[known] + spectra_weight * similarity
+        return scores
+
+    def match(self, maps, ch_names, spectra=None, freqs=None, threshold=0.8, spectra_weight=0.3):
+        # {component: (label, score, excluded)} for the labels that match above threshold
+        if not len(self) or len(set(self.ch_names) & set(ch_names)) < 3:
+            return {}
+        from scipy.optimize import linear_sum_assignment
+        scores = self.scores(maps, ch_names, spectra, freqs, spectra_weight)
+        labels, inverse = np.unique(self.labels, return_inverse=True)
+        best = np.full((len(labels), scores.shape[1]), -np.inf)
+        np.maximum.at(best, inverse, scores)
+        rows, cols = linear_sum_assignment(best, maximize=True)
+        excluded = np.zeros(len(labels), dtype=bool)
+        excluded[inverse] = self.excluded # the latest template of a label decides
+        return {int(comp): (str(labels[row]), float(best[row, comp]), bool(excluded[row]))
+                for row, comp in zip(rows, cols) if best[row, comp] >= threshold}
+
+    def match_ica(self, ica, threshold=0.8):
+        # Topographies only (no data needed)
+        return self.match(ica.get_components(), ica.ch_names, threshold=threshold)
+
+class ICAData:
+    # Sources and precomputed statistics the pages are drawn from. Holds no Qt
+    # objects, so the same pages can be built by the application and by the
+    # headless exporter. Expects self.parameters to be set. Continuous data
+    # (mne.io.Raw) is reviewed as fixed-length segments of segment_duration.
+    def setup_data(self, ica, epochs, apply_baseline=True):
+        # Instrumentation (no-op unless profile=True)
+        self.profiler = ICAProfiler(self.parameters['profile'])
 
-        # Get the current figure and canvas
-        fig = self.app.figures[index]
+        # Main Inputs:
+        self.ica = ica.copy()
+        self.continuous = isinstance(epochs, mne.io.BaseRaw)
+        self.raw = epochs if self.continuous else None
+
+        # Nothing is dropped from the input (lazy data stays lazy): the pages use
+        # the EEG channels and the metrics the EOG/ECG ones, both read with picks
+        self.eeg_picks = mne.pick_types(epochs.info, eeg=True, exclude=[])
+        self.artifact_picks = mne.pick_types(epochs.info, eog=True, ecg=True, exclude='bads')
+        self.read_picks = np.concatenate([self.eeg_picks, self.artifact_picks])
+        self.info = mne.pick_info(epochs.info, self.eeg_picks)
+        self.artifact_info = mne.pick_info(epochs.info, self.artifact_picks) if len(self.artifact_picks) else None
+        if self.continuous:
+            self.epochs = self.segments(self.raw)
+            self.source_chunks = ICASourceChunks(self.ica, self.raw)
+            self.segment_starts = (self.epochs.events[:, 0] - self.raw.first_samp) / self.raw.info['sfreq']
+        else:
+            self.epochs = epochs
+            if apply_baseline:
+                self.epochs.apply_baseline(verbose=None)
+            if not self.epochs.preload:
+                self.drop_bad_lazy(self.epochs) # the number of epochs must be known up front
 
-        if index == 0:
-            self.plot_overview(fig)
+        # Get Main Parameters:
+        self.exclude = np.sort(self.ica.exclude).tolist()
+        self.n_components = self.ica.n_components_
+        self.label_digits = max(3, len(str(self.n_components)))
+        self.ica_labels = ['Component ' + str(i).zfill(self.label_digits) for i in range(1, self.n_components+1)]
+
+        # Sources, statistics and spectra are filled in one pass over the epochs,
+        # block by block (load_block). Only the first block is loaded here,
+        # unless the disk cache already has the result of the whole pass.
+        self.variance_engine = ICAVarianceEngine(self.ica, self.info.ch_names, self.epochs.times,
+                                                 baseline=not self.continuous)
+        self.segment_summary = None
+        if self.continuous:
+            self.segment_summary = ICASegmentSummary(self.n_components, len(self.epochs.times))
+            self.segment_cache = OrderedDict()
+            self.segment_lock = threading.Lock()
+        self.spectra = ICASpectra(self.epochs.info['sfreq'], len(self.epochs.times),
+                                  self.parameters['psd_xlim'], self.parameters['psd_method'])
+        self.spectra_sum = np.zeros((self.n_components, len(self.spectra.freqs)))
+        self.setup_time_frequency()
+        self.metrics_engine = ICAMetrics(self.n_components, self.artifact_info)
+        self.psd_cache = {}
+        self.clean_writer = None
+        self.n_loaded = 0
+        self.data_version = 0
+        self.disk_cache = None
+        if self.parameters['cache_dir'] is not None:
+            self.disk_cache = ICADiskCache(self.parameters['cache_dir'], self.parameters['cache_max_mb'] * 2**20)
+            self.cache_key = self.disk_cache.key(self.ica, self.epochs, self.parameters,
+                                                 self.eeg_picks, self.artifact_picks)
+        cached = None
+        if self.disk_cache is not None:
+            with self.profiler.span('cache.load'):
+                cached = self.disk_cache.load(self.cache_key)
+        if cached is not None:
+            self.restore(cached)
         else:
-            self.plot_component(fig, index-1)
+            self.source_data = self.allocate_sources()
+            self.load_block()
 
-        # emit the signal
-        data = {
-            'done': True
-        }
+        # Explained Variance Engine
+        self.original_explained_variance = self.variance_engine.original_power
+        self.metrics = self.compute_metrics()
 
-        self.finished_signal.emit(data)
+        # Plot Control
+        self.exclude_state = ICAExcludeState(self.variance_engine, self.exclude)
+
+        # Components matching the template library are pre-marked
+        self.template_library = None
+        self.template_matches = {}
+        if self.parameters['templates'] is not None:
+            self.match_templates()
+        self.page_versions = [None] * (self.n_components + 1)
+        self.figure_is_empty = [True] * (self.n_components + 1)
+        self.evoked_cache = ICAEvokedCache(self.variance_engine)
+
+        # Trial images (pooled to the canvas resolution)
+        self.trial_images = TrialImageLOD(self.source_data)
+
+        # Topomaps (one interpolator for the montage, all maps rendered at once)
+        ica_info = mne.pick_info(self.info, [self.info.ch_names.index(ch) for ch in self.ica.ch_names])
+        components = self.ica.get_components()
+        self.topomaps = TopomapInterpolator(ica_info)
+        self.topomap_images = self.topomaps.images(components)
+        self.topomap_vlim = np.max(np.abs(components), axis=0)
+
+    def allocate_sources(self):
+        # One preallocated buffer for all sources. With low_memory it is a
+        # memory-mapped file, so only the blocks in use are resident and every
+        # plot reads its slices straight from disk.
+        n_times = len(self.epochs.times)
+        if self.continuous: # segment envelopes only
+            n_times = self.segment_summary.n_bins
+        shape = (len(self.epochs), self.n_components, n_times)
+        dtype = np.dtype(self.parameters['source_dtype'])
+        if self.parameters['low_memory']:
+            f = tempfile.NamedTemporaryFile(prefix='icapp-sources-', suffix='.dat',
+                                            dir=self.parameters['memmap_dir'], delete=False)
+            f.close()
+            source_data = np.memmap(f.name, dtype=dtype, mode='w+', shape=shape)
+            weakref.finalize(source_data, ICAData.remove_file, f.name)
+            return source_data
+        return np.zeros(shape, dtype=dtype) # epochs not loaded yet read as zeros
+
+    @property
+    def loaded(self):
+        return self.n_loaded == len(self.epochs)
+
+    def load_block(self, block_size=64):
+        # Read the next block of epochs (from disk if not preloaded), unmix it and
+        # add it to every running statistic. Returns the number of epochs loaded.
+        # EEG and EOG/ECG channels come from the same read.
+        profiler = self.profiler
+        start = self.n_loaded
+        with profiler.span('load.read', start=start):
+            block = self.epochs.get_data(picks=self.read_picks, item=slice(start, start + block_size),
+                                         verbose=False)
+        data, reference = block[:, :len(self.eeg_picks)], block[:, len(self.eeg_picks):]
+        n_epochs = len(data)
+        with profiler.span('load.unmix'):
+            picks = self.variance_engine.picks
+            sources = self.ica._transform(np.hstack(data[:, picks]))
+            sources = sources.reshape(self.n_components, n_epochs, -1).transpose(1, 0, 2)
+            if self.continuous:
+                self.source_data[start:start + n_epochs] = self.segment_summary.add_block(sources, start)
+            else:
+                self.source_data[start:start + n_epochs] = sources
+        with profiler.span('load.statistics'):
+            self.variance_engine.add_block(data, sources)
+        with profiler.span('load.spectra'):
+            self.spectra_sum += self.spectra.log_sum(sources)
+        with profiler.span('load.metrics'):
+            self.metrics_engine.add_block(sources, reference)
+        self.n_loaded += n_epochs
+        profiler.sample_memory()
+        if self.loaded and isinstance(self.source_data, np.memmap):
+            self.source_data.flush()
+        return self.n_loaded
+
+    def save_cache(self):
+        if self.disk_cache is not None and self.loaded:
+            with self.profiler.span('cache.save'):
+                self.disk_cache.save(self.cache_key, self.source_data, self.cached_arrays())
+
+    def cached_arrays(self):
+        engine = self.variance_engine
+        arrays = {'sum_' + name: np.asarray(value) for name, value in engine.sums.items()}
+        arrays.update({'metric_' + name: np.asarray(value) for name, value in self.metrics_engine.sums.items()})
+        arrays.update({
+            'n_epochs': np.asarray(engine.n_epochs),
+            'min_sources': engine.min_sources,
+            'max_sources': engine.max_sources,
+            'spectra_sum': self.spectra_sum,
+        })
+        if self.continuous:
+            arrays.update({'segment_' + name: value for name, value in self.segment_summary.arrays.items()})
+        return arrays
+
+    def restore(self, cached):
+        # Whole pass from the disk cache (sources stay memory-mapped from it)
+        engine = self.variance_engine
+        engine.sums = {name[4:]: cached[name] for name in cached if name.startswith('sum_')}
+        engine.n_epochs = int(cached['n_epochs'])
+        engine.min_sources = cached['min_sources']
+        engine.max_sources = cached['max_sources']
+        engine.update()
+        self.metrics_engine.sums = {name[7:]: cached[name] for name in cached if name.startswith('metric_')}
+        if self.continuous:
+            self.segment_summary.arrays = {name[8:]: cached[name] for name in cached if name.startswith('segment_')}
+        self.spectra_sum = cached['spectra_sum']
+        self.source_data = cached['source_data']
+        self.n_loaded = engine.n_epochs
+
+    def load_all(self):
+        while not self.loaded:
+            self.load_block()
+        self.refresh_data()
+        self.save_cache()
+
+    def refresh_data(self):
+        # The statistics changed (more epochs are in): drop everything derived
+        # from them. Pages notice the new data_version and are rebuilt.
+        self.original_explained_variance = self.variance_engine.original_power
+        self.exclude_state.reset()
+        self.evoked_cache.clear()
+        self.trial_images.clear()
+        psd_cache = {}
+        if self.loaded:
+            psd_cache[self.spectra.key] = self.spectra_sum / self.n_loaded
+        self.psd_cache = psd_cache
+        self.metrics = self.compute_metrics()
+        self.data_version += 1
+
+    def compute_metrics(self):
+        # Columns of the component table (see ICAMetrics), from the epochs loaded so far
+        return self.metrics_engine.compute(self.variance_engine, self.spectra,
+                                           self.spectra_sum / self.n_loaded,
+                                           self.epochs.info['line_freq'])
+
+    @staticmethod
+    def drop_bad_lazy(epochs):
+        # epochs.drop_bad() without reading the data when only the event times
+        # decide (epochs overlapping BAD_* annotations or running past the
+        # recording), where MNE would read every epoch to find them. Amplitude
+        # criteria (reject/flat) need the data, so those still take a full pass.
+        raw = getattr(epochs, '_raw', None)
+        if not isinstance(raw, mne.io.BaseRaw) or epochs.reject is not None or epochs.flat is not None \
+                or epochs.reject_tmin is not None or epochs.reject_tmax is not None:
+            epochs.drop_bad(verbose=False)
+            return epochs
+        sfreq = raw.info['sfreq']
+        n_samples = len(epochs._raw_times)
+        start = np.round(epochs.events[:, 0] + epochs._raw_times[0] * sfreq).astype(int) - raw.first_samp
+        reasons = {int(index): 'NO_DATA' for index in np.flatnonzero(start < 0)}
+        if epochs.reject_by_annotation:
+            for index, annotations in enumerate(epochs.get_annotations_per_epoch()):
+                bad = [description for _, _, description in annotations if description.lower().startswith('bad')]
+                if bad and index not in reasons:
+                    reasons[index] = bad[0]
+            epochs.reject_by_annotation = False # already applied
+        for index in np.flatnonzero(start + n_samples > raw.n_times):
+            reasons.setdefault(int(index), 'NO_DATA')
+        selection = epochs.selection.copy()
+        for reason in set(reasons.values()): # drop_log gets the reason of each epoch
+            dropped = selection[[index for index in reasons if reasons[index] == reason]]
+            epochs.drop(np.flatnonzero(np.isin(epochs.selection, dropped)), reason=reason, verbose=False)
+        epochs.drop_bad(verbose=False) # nothing left to reject, only checks the first and last epoch
+        return epochs
+
+    def segments(self, raw):
+        # Lazy fixed-length epochs over a continuous recording, streamed by
+        # load_block like any other epochs. Segments overlapping BAD_* spans are
+        # dropped from the annotations alone, nothing is read here.
+        epochs = mne.make_fixed_length_epochs(raw, duration=self.parameters['segment_duration'],
+                                              preload=False, reject_by_annotation=True, proj=False,
+                                              verbose=False)
+        return self.drop_bad_lazy(epochs)
+
+    def segment(self, index):
+        # Channel data and sources of one segment (continuous data), LRU cached
+        with self.segment_lock:
+            if index in self.segment_cache:
+                self.segment_cache.move_to_end(index)
+                return self.segment_cache[index]
+            data = self.epochs.get_data(picks=self.eeg_picks, item=[index], verbose=False)[0]
+            sources = self.ica._transform(data[self.variance_engine.picks])
+            self.segment_cache[index] = (data, sources)
+            while len(self.segment_cache) > 32:
+                self.segment_cache.popitem(last=False)
+        return data, sources
+
+    def butterfly_data(self, exclude, comp):
+        # Channel data behind the component page butterflies: the average over
+        # epochs, or for continuous data the segment where comp is strongest
+        if not self.continuous:
+            return self.evoked_cache.get_data(exclude)
+        data, sources = self.segment(self.segment_summary.arrays['peak_segment'][comp])
+        engine = self.variance_engine
+        data = engine.reference(data[None])[0]
+        exclude = np.unique(np.asarray(exclude, dtype=int)) # exclude + [comp] may repeat comp
+        return data - engine.mixing[:, exclude] @ sources[exclude]
+
+    def component_activity(self):
+        # Time course drawn under each topomap: average over epochs, or the
+        # strongest segment for continuous data
+        if self.continuous:
+            return self.segment_summary.arrays['peak_sources']
+        return self.variance_engine.mean_sources
+
+    def trial_limits(self, comp):
+        if self.continuous:
+            return 0, self.segment_summary.arrays['max_envelope'][comp]
+        return self.variance_engine.min_sources[comp], self.variance_engine.max_sources[comp]
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def write_cleaned(self, path, exclude=None, n_jobs=None, progress=None):
+        # Cleaned epochs/raw of the reviewed data, reusing the precomputed sources
+        # (see ICACleanWriter)
+        if exclude is None:
+            exclude = self.exclude_state.exclude
+        self.clean_writer = ICACleanWriter(self.ica, self.raw if self.continuous else self.epochs,
+                                           exclude=exclude,
+                                           picks=self.eeg_picks,
+                                           source_data=self.source_data if self.loaded else None,
+                                           n_jobs=n_jobs,
+                                           memmap_dir=self.parameters['memmap_dir'])
+        with self.profiler.span('export.cleaned'):
+            return self.clean_writer.write(path, progress)
+
+    def adopt_data(self, other):
+        # Take over everything setup_data computed on another ICAData (e.g. a
+        # subject prepared in the background), except the parameters
+        state = dict(other.__dict__)
+        state.pop('parameters', None)
+        self.__dict__.update(state)
+
+    def setup_style(self, text_color='#000000', bg_color='#ffffff'):
+        self.text_color = text_color
+        self.bg_color = bg_color
+
+        # Plot Visual Parameters (white grid look, previously set by seaborn at import)
+        import matplotlib
+        matplotlib.rcParams.update({
+            'axes.grid': True,
+            'axes.axisbelow': True,
+            'axes.edgecolor': '.8',
+            'axes.linewidth': 1.0,
+            'axes.prop_cycle': matplotlib.cycler(color=['#001c7f', '#b1400d', '#12711c', '#8c0800', '#591e71',
+                                                        '#592f0d', '#a23582', '#3c3c3c', '#b8850a', '#006374']),
+            'grid.color': '.8',
+            'lines.linewidth': 1.2,
+            'lines.solid_capstyle': 'round',
+            'patch.edgecolor': 'w',
+            'patch.force_edgecolor': True,
+            'xtick.bottom': False,
+            'ytick.left': False,
+            'xtick.color': '.15',
+            'ytick.color': '.15',
+            'legend.fontsize': 8,
+        })
+        matplotlib.rcParams.update({
+            'font.family': 'sans-serif',
+            'font.sans-serif': ['Arial', 'DejaVu Sans', 'Liberation Sans', 'Bitstream Vera Sans', 'sans-serif'],
+            'font.size': 8,
+            'axes.titlesize': 10,
+            'axes.labelsize': 8,
+            'xtick.labelsize': 8,
+            'ytick.labelsize': 8,
+            'text.color': self.text_color,
+            'axes.labelcolor': self.text_color,
+            # 'axes.edgecolor': (self.text_color),
+            # 'xtick.color': self.text_color,
+            # 'ytick.color': self.text_color,
+            'figure.facecolor': self.bg_color,
+            'axes.facecolor': (1,1,1,self.parameters['bg_alpha'])})
 
-    def plot_overview(self, fig):
-        if self.app.figure_is_empty[0]:
-            components = self.app.ica.get_components()
-            bad_channels = self.app.epochs.info['bads']
-            ch_names = self.app.epochs.ch_names
-            ch_names = [ch for ch in ch_names if ch not in bad_channels]
-            new_info = mne.create_info(ch_names, self.app.epochs.info['sfreq'], ch_types='eeg')
-            new_info.set_montage(self.app.epochs.get_montage())
+    def match_templates(self):
+        # Marks the components that match a template of the library as kept or
+        # removed, like the template was
+        with self.profiler.span('templates.match'):
+            self.template_library = ICATemplateLibrary(self.parameters['templates'])
+            self.template_matches = self.template_library.match(self.ica.get_components(), self.ica.ch_names,
+                                                                self.spectra_sum / max(self.n_loaded, 1),
+                                                                self.spectra.freqs,
+                                                                self.parameters['template_threshold'])
+        for excluded in [True, False]:
+            comps = [comp for comp, match in self.template_matches.items() if match[2] == excluded]
+            self.exclude_state.set_excluded(comps, excluded)
+        self.exclude = self.exclude_state.exclude
+        self.ica.exclude = list(self.exclude)
+
+    def open_journal(self):
+        # Decision journal of this ICA (parameters['journal_dir']). One left by a
+        # session that did not close, opened from the same exclude list, is
+        # replayed over it.
+        self.journal = None
+        if self.parameters['journal_dir'] is None:
+            return
+        self.journal = ICADecisionJournal(self.parameters['journal_dir'],
+                                          ICADecisionJournal.fingerprint(self.ica), self.n_components)
+        opened = self.exclude_state.exclude
+        exclude = self.journal.replay()
+        if exclude is not None and self.journal.opened == opened and exclude != opened:
+            print(f'ICApp: restored the excluded components from {self.journal.path}')
+            excluded = np.zeros(self.n_components, dtype=bool)
+            excluded[exclude] = True
+            self.exclude_state.set_excluded(np.flatnonzero(self.exclude_state.excluded & ~excluded), False)
+            self.exclude_state.set_excluded(np.flatnonzero(excluded & ~self.exclude_state.excluded), True)
+            self.ica.exclude = list(self.exclude_state.exclude)
+        self.journal.start(self.exclude_state.exclude, opened)
+
+    def setup_time_frequency(self):
+        # Optional ERSP/ITC panel of the component pages (epochs only)
+        self.time_frequency = None
+        if self.parameters['tfr'] and not self.continuous:
+            self.time_frequency = ICATimeFrequency(self.epochs.info['sfreq'], self.epochs.times,
+                                                   self.parameters['tfr_freqs'],
+                                                   self.parameters['tfr_decim'],
+                                                   self.parameters['tfr_cache_mb'] * 2**20)
+
+    def component_tfr(self, comp):
+        # ERSP/ITC of a component, computed on the spot (headless export). The
+        # application computes them in the background instead.
+        result = self.time_frequency.get(comp)
+        if result is None:
+            with self.profiler.span('tfr', comp=comp):
+                result = self.time_frequency.compute(self.source_data[:, comp, :])
+            self.time_frequency.put(comp, result)
+        return result
+
+    def cache_stats(self):
+        # Hit/miss counts of the in-memory and disk caches, for the profiler
+        stats = {
+            'evoked_cache': (self.evoked_cache.hits, self.evoked_cache.misses),
+            'trial_images': (self.trial_images.hits, self.trial_images.misses),
+        }
+        if self.time_frequency is not None:
+            stats['tfr'] = (self.time_frequency.hits, self.time_frequency.misses)
+        if self.disk_cache is not None:
+            stats['disk_cache'] = (self.disk_cache.hits, self.disk_cache.misses)
+        if self.continuous:
+            stats['source_chunks'] = (self.source_chunks.hits, self.source_chunks.misses)
+        return stats
+
+    def snapshot(self):
+        # Exclude state as seen by a render job
+        state = self.exclude_state
+        return {
+            'version': state.version,
+            'exclude': state.exclude,
+            'excluded': state.excluded.copy(),
+            'explained_variance': state.explained_variance(),
+            'explained_variance_with_each': state.explained_variance_with_each(),
+        }
 
-            sources = self.app.source_data
+# %% Page Rendering
+class ICAPageRenderer:
+    # Builds the page figures and rasterizes them offscreen with Agg. Runs in the
+    # render pool, so it only reads the exclude state through a snapshot.
+    def __init__(self, app):
+        self.app = app
 
+    def render(self, fig, page, snapshot, size=None, dpi=100):
+        if size is not None:
+            fig.set_dpi(dpi)
+            fig.set_size_inches(size[0] / dpi, size[1] / dpi)
+
+        # Pages drawn before all epochs were loaded are rebuilt
+        if getattr(fig, 'data_version', None) != self.app.data_version:
+            fig.data_version = self.app.data_version
+            self.app.figure_is_empty[page] = True
+            self.app.page_versions[page] = None
+
+        profiler = self.app.profiler
+        if page == 0:
+            with profiler.span('overview.plot'):
+                self.plot_overview(fig, snapshot)
+        else:
+            with profiler.span('component.plot', page=page):
+                self.plot_component(fig, page-1, snapshot)
+                self.update_trial_image(fig.trial_axes)
+
+        # Interactive pages are drawn by their Qt canvas
+        if size is None:
+            return None
+
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        if not isinstance(fig.canvas, FigureCanvasAgg):
+            FigureCanvasAgg(fig)
+        if page == 0:
+            with profiler.span('overview.draw'):
+                self.draw_overview(fig, (size, dpi, fig.data_version))
+        else:
+            with profiler.span('component.draw', page=page):
+                fig.canvas.draw()
+        return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+    def draw_overview(self, fig, key):
+        # The topomaps and traces never change, so they are kept as a background
+        # buffer and only the titles whose colour changed are blitted on top
+        canvas = fig.canvas
+        titles = [ax.title for ax in fig.axes[::2]]
+        colors = [title.get_color() for title in titles]
+        if getattr(fig, 'overview_key', None) != key:
+            for title in titles:
+                title.set_alpha(0) # keep the constrained layout unchanged
+            canvas.draw()
+            fig.overview_background = canvas.copy_from_bbox(fig.bbox)
+            fig.overview_key = key
+            for title in titles:
+                title.set_alpha(None)
+                fig.draw_artist(title)
+        else:
+            renderer = canvas.get_renderer()
+            height = fig.bbox.height
+            for title, color, drawn in zip(titles, colors, fig.overview_colors):
+                if color == drawn:
+                    continue
+                # Agg regions are addressed from the top-left corner
+                bbox = title.get_window_extent(renderer).padded(2)
+                extents = (bbox.x0, height - bbox.y1, bbox.x1, height - bbox.y0)
+                canvas.restore_region(fig.overview_background, bbox=extents, xy=(0, 0))
+                fig.draw_artist(title)
+        fig.overview_colors = colors
+
+    def plot_overview(self, fig, snapshot):
+        if self.app.figure_is_empty[0]:
+            fig.clf()
             def optimal_subplot_grid(N):
                             # Find the square root of N to start approximating the grid
                             sqrt_N = np.sqrt(N)
@@ -84,7 +1646,7 @@ class ICAWorkerThread(QThread):
                 rows = 5
                 cols = int(np.ceil(self.app.n_components / rows))
 
-            gs = gridspec.GridSpec(3 * rows, cols, fig)  # 3 rows per component
+            gs = fig.add_gridspec(3 * rows, cols)  # 3 rows per component
 
             for i in range(self.app.n_components):
                 row_idx = i // cols
@@ -92,14 +1654,13 @@ class ICAWorkerThread(QThread):
                 
                 # Create the topomap axis using GridSpec
                 ax_topo = fig.add_subplot(gs[3*row_idx:3*row_idx+2, col_idx])
-                mne.viz.plot_topomap(components[:, i],
-                                     new_info,
-                                     axes=ax_topo,
-                                     cmap=self.app.parameters['cmap'],
-                                     show=False)
+                self.app.topomaps.plot(ax_topo,
+                                       self.app.topomap_images[i],
+                                       self.app.topomap_vlim[i],
+                                       self.app.parameters['cmap'])
                 
                 color = self.app.text_color
-                if i in self.app.exclude:
+                if snapshot['excluded'][i]:
                     color = 'red'
                 ax_topo.set_title(self.app.ica_labels[i],
                              fontsize=8,
@@ -109,8 +1670,7 @@ class ICAWorkerThread(QThread):
                 ax_time = fig.add_subplot(gs[3*row_idx+2, col_idx])
                 
                 # Plot your time series data here. For the sake of this example, I'm using random data
-                component_epochs = sources[:, i, :]
-                mean_activity = np.mean(component_epochs, axis=0)
+                mean_activity = self.app.component_activity()[i]
                 ax_time.axvline(0, color='k', linestyle='--', alpha=0.5)  # Add a vertical line at time 0
                 ax_time.plot(self.app.epochs.times, mean_activity)
                 t0, t1 = self.app.parameters['overview_avg_xlim'][0], self.app.parameters['overview_avg_xlim'][1]
@@ -123,32 +1683,31 @@ class ICAWorkerThread(QThread):
 
             self.app.figure_is_empty[0] = False
 
-        else:
+        elif self.app.page_versions[0] != snapshot['version']:
             axs = fig.axes
             for i in range(self.app.n_components):
                 color = self.app.text_color
-                if i in self.app.ica.exclude:
+                if snapshot['excluded'][i]:
                     color = 'red'
-                axs[i*2].set_title(self.app.ica_labels[i],
-                                   fontsize=8,
-                                   color=color)
+                axs[i*2].title.set_color(color)
+        self.app.page_versions[0] = snapshot['version']
         return
 
-    def plot_component(self, fig, comp):
+    def plot_component(self, fig, comp, snapshot):
+        profiler = self.app.profiler
         if self.app.figure_is_empty[comp+1]:
             # Clear Current Figure
             fig.clf()
 
             # Get data
-            epochs = self.app.epochs.copy()
-            ica = self.app.ica.copy()
+            epochs = self.app.epochs
             sources = self.app.source_data
 
             # Get the component epochs
             component_epochs = sources[:, comp, :]
 
-            # Initializing Figure
-            gs = fig.add_gridspec(6, 2)
+            # Initializing Figure (a third column for the time-frequency panel)
+            gs = fig.add_gridspec(6, 2 if self.app.time_frequency is None else 3)
             axs = [
                 fig.add_subplot(gs[0:2, 0]), # Evoked
                 fig.add_subplot(gs[0:2, 1]), # Evoked - Component
@@ -158,530 +1717,560 @@ class ICAWorkerThread(QThread):
                 fig.add_subplot(gs[4:6, 1]), # Topo
             ]
 
-            # Trials/Epochs
-            im = axs[2].imshow(component_epochs,
-                               aspect='auto',
-                               cmap=self.app.parameters['cmap'])
-            axs[2].set_title('Component Activity')
-            axs[2].set_xticks([epochs.time_as_index(0)[0]], [''])
-            axs[2].set_ylabel('Trial')
+            # Trials/Epochs (pooled to the canvas resolution, see update_trial_image);
+            # segment envelopes for continuous data
+            with profiler.span('component.trials'):
+                n_epochs, n_times = component_epochs.shape
+                vmin, vmax = self.app.trial_limits(comp)
+                im = axs[2].imshow(self.app.trial_images.get(comp, (1, 1)),
+                                   aspect='auto',
+                                   cmap=self.app.parameters['cmap'],
+                                   extent=(-0.5, n_times - 0.5, n_epochs - 0.5, -0.5),
+                                   vmin=vmin,
+                                   vmax=vmax)
+                axs[2].set_autoscale_on(False)
+                axs[2].trial_image = im
+                axs[2].trial_component = comp
+                axs[2].callbacks.connect('xlim_changed', self.trial_view_changed)
+                axs[2].callbacks.connect('ylim_changed', self.trial_view_changed)
+                fig.trial_axes = axs[2]
+                self.update_trial_image(axs[2])
+                if self.app.continuous:
+                    axs[2].set_title('Segment RMS')
+                    axs[2].set_xticks([], [])
+                    axs[2].set_ylabel('Segment')
+                else:
+                    axs[2].set_title('Component Activity')
+                    axs[2].set_xticks([epochs.time_as_index(0)[0]], [''])
+                    axs[2].set_ylabel('Trial')
 
             # PSD
-            f1, f2 = self.app.parameters['psd_xlim']
-            if f1 is None:
-                f1 = 1
-            if f2 is None:
-                f2 = 50
-            spec, freqs = mne.time_frequency.psd_array_multitaper(component_epochs, sfreq=epochs.info['sfreq'], fmin=f1, fmax=f2, verbose=False)
-            spec = 10 * np.log10(spec)
-            axs[3].plot(freqs, np.mean(spec, axis=0), linewidth=1.5)
-            axs[3].set_xlim([f1, f2])
+            spectra = self.app.spectra
+            spec = self.app.psd_cache.get(spectra.key)
+            if spec is not None:
+                spec = spec[comp]
+                profiler.count('psd_cache.hit')
+            else:
+                # Still loading: mean over the epochs loaded so far
+                profiler.count('psd_cache.miss')
+                n_loaded = self.app.n_loaded
+                spec = self.app.spectra_sum[comp] / n_loaded
+            axs[3].plot(spectra.freqs, spec, linewidth=1.5)
+            axs[3].set_xlim([spectra.key[0], spectra.key[1]])
             axs[3].set_title('Power Spectrum')
             axs[3].set_xlabel('Frequency (Hz)')
             axs[3].set_ylabel('Power (dB)')
 
-            # Average
-            mean_activity = np.mean(component_epochs, axis=0)
+            # Average (strongest segment for continuous data)
+            mean_activity = self.app.component_activity()[comp]
             axs[4].plot(epochs.times, mean_activity, linewidth=1.5)
             axs[4].set_xlim([epochs.times[0], epochs.times[-1]])
-            axs[4].set_title('Average Activity')
+            if self.app.continuous:
+                segment = self.app.segment_summary.arrays['peak_segment'][comp]
+                axs[4].set_title(f'Strongest Segment ({self.app.segment_starts[segment]:.1f} s)')
+            else:
+                axs[4].set_title('Average Activity')
             axs[4].set_xlabel('Time (s)')
             axs[4].set_ylabel('Amplitude')
 
             # Topo
-            ica.plot_components([comp],
-                                axes=axs[5],
-                                cmap=self.app.parameters['cmap'],
-                                title='',
-                                # image_interp='nearest',
-                                show=False)
+            with profiler.span('component.topomap'):
+                self.app.topomaps.plot(axs[5],
+                                       self.app.topomap_images[comp],
+                                       self.app.topomap_vlim[comp],
+                                       self.app.parameters['cmap'])
             axs[5].set_title('Topography')
 
+            # Time-frequency (a placeholder until computed, see update_time_frequency)
+            if self.app.time_frequency is not None:
+                fig.tfr_axes = [fig.add_subplot(gs[0:3, 2]), fig.add_subplot(gs[3:6, 2])]
+                fig.tfr_drawn = None
+
             # Noting that the figure is not empty anymore
             self.app.figure_is_empty[comp+1] = False
         
+        if self.app.time_frequency is not None:
+            self.update_time_frequency(fig, comp)
+
+        # Page is up to date with the current exclude set
+        if self.app.page_versions[comp+1] == snapshot['version']:
+            return
+
         # Dataset Evoked Signal (Original)-(Droped)
-        if self.app.changing_component is not None or not np.any(self.app.dataset_is_updated): # Update Dataset Evoked Signal if Needed 
-            self.app.clear_epochs, self.app.clear_var = self.apply_dropping()
-            self.app.dataset_is_updated = [False] * (self.app.n_components)
-            self.app.component_is_updated = [False] * (self.app.n_components)
-            if self.app.changing_component == comp:
-                self.app.component_is_updated[comp] = True
-        
-        if not self.app.dataset_is_updated[comp]:
-            ax = fig.axes[0]
-            ax.clear()
-            # Display Dataset Evoked Signal
-            if self.app.parameters['interactive_butterfly']:
-                self.app.clear_epochs.average().plot(axes=ax, show=False)
-            else:
-                # ax.plot(self.app.clear_epochs.times, self.app.clear_epochs.average().data.T, linewidth=1.5)
-                # ax.set_xlim([self.app.clear_epochs.times[0], self.app.clear_epochs.times[-1]])
-                self.app.clear_epochs.average().plot(axes=ax, show=False, selectable=False)
-            ax.set_title(f'Dataset ({self.app.clear_var:.2f}%)')
+        clear_var = snapshot['explained_variance']
+        with profiler.span('component.butterfly'):
+            self.plot_butterfly(fig.axes[0], snapshot['exclude'], comp)
+        fig.axes[0].set_title(f'Dataset ({clear_var:.2f}%)')
 
         # Signal with Current ICA Component Removed
-        if not self.app.component_is_updated[comp]:
-            new_epochs, new_var = self.apply_dropping(comp)
-            ax = fig.axes[1]
-            ax.clear()
-            if self.app.parameters['interactive_butterfly']:
-                new_epochs.average().plot(axes=ax, show=False)
-            else:
-                # ax.plot(new_epochs.times, new_epochs.average().data.T, linewidth=1.5)
-                # ax.set_xlim([new_epochs.times[0], new_epochs.times[-1]])
-                new_epochs.average().plot(axes=ax, show=False, selectable=False)
-            ax.set_title(f'Dataset - ICA{str(comp).zfill(3)} ({new_var:.2f}%)')
-        
-        self.app.changing_component = None
-        self.app.dataset_is_updated[comp] = True
-        self.app.component_is_updated[comp] = True
-        return
-
-    def apply_dropping(self, new_exclude = None):
-        # Get data
-        epochs = self.app.epochs.copy()
-        ica = self.app.ica.copy()
-
-        if new_exclude is not None:
-            ica.exclude += [new_exclude]
-
-        # Calculate New Explained Variance
-        ica.apply(epochs, verbose=False)
-        epochs.apply_baseline(verbose=None) # ICA can introduce DC shifts
-        after_removal = np.sum(epochs.get_data()**2)
-
-        var = 100 * (after_removal/self.app.original_explained_variance)
-
-        return epochs, var
-
-class ICABlockingDialog(QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setModal(True)
-        layout = QVBoxLayout()
-        layout.addWidget(QLabel("Processing... Please wait."))
-        self.setLayout(layout)
-
-class ICA_Application(QWidget):
-    def __init__(self, ica, epochs,
-                 cmap='jet',
-                 apply_baseline = True,
-                 psd_xlim = [None, None],
-                 interactive_butterfly = True,
-                 overview_avg_xlim = [None, None],
-                 bg_alpha=1):
-        super().__init__()
-        self.setWindowTitle('ICApp')
+        new_var = snapshot['explained_variance_with_each'][comp]
+        with profiler.span('component.butterfly'):
+            self.plot_butterfly(fig.axes[1], snapshot['exclude'] + [comp], comp)
+        fig.axes[1].set_title(f'Dataset - ICA{str(comp).zfill(self.app.label_digits)} ({new_var:.2f}%)')
 
-        # Main Inputs:
-        self.ica = ica.copy()
-        self.epochs = epochs
-        self.epochs.pick('eeg')
-        if apply_baseline:
-            self.epochs.apply_baseline(verbose=None)
+        self.app.page_versions[comp+1] = snapshot['version']
+        return
 
-        # Get Main Parameters:
-        self.exclude = np.sort(self.ica.exclude).tolist()
-        self.n_components = self.ica.n_components_
-        self.ica_labels = ['Component ' + str(i).zfill(3) for i in range(1, self.n_components+1)]
-        self.original_explained_variance = np.sum(epochs.get_data()**2)
+    def update_trial_image(self, ax):
+        # Re-sample the trial image for the current axes size and view
+        n_epochs, _, n_times = self.app.source_data.shape
+        x0, x1 = sorted(ax.get_xlim())
+        y0, y1 = sorted(ax.get_ylim())
+        view = (max(0, int(np.floor(y0 + 0.5))), min(n_epochs, int(np.ceil(y1 + 0.5))),
+                max(0, int(np.floor(x0 + 0.5))), min(n_times, int(np.ceil(x1 + 0.5))))
+        if view[0] >= view[1] or view[2] >= view[3]:
+            return
+        bbox = ax.get_window_extent()
+        shape = (max(1, int(bbox.height)), max(1, int(bbox.width)))
+        data = self.app.trial_images.get(ax.trial_component, shape, view)
+        if data is not ax.trial_image.get_array().data:
+            e0, e1, t0, t1 = view
+            ax.trial_image.set_data(data)
+            ax.trial_image.set_extent((t0 - 0.5, t1 - 0.5, e1 - 0.5, e0 - 0.5))
+
+    def trial_view_changed(self, ax):
+        # Zoom/pan on an interactive canvas
+        if getattr(ax, 'trial_updating', False):
+            return
+        ax.trial_updating = True
+        self.update_trial_image(ax)
+        ax.trial_updating = False
+        ax.figure.canvas.draw_idle()
+
+    def update_time_frequency(self, fig, comp):
+        # ERSP/ITC panel: a placeholder, replaced once the result is available
+        if fig.tfr_drawn:
+            return
+        result = self.app.component_tfr(comp)
+        if result is None and fig.tfr_drawn is False:
+            return
+        tf = self.app.time_frequency
+        ax_ersp, ax_itc = fig.tfr_axes
+        for ax in fig.tfr_axes:
+            ax.clear()
+        ax_ersp.set_title('ERSP (dB)')
+        ax_itc.set_title('ITC')
+        if result is None:
+            for ax in fig.tfr_axes:
+                ax.text(0.5, 0.5, 'Computing...', transform=ax.transAxes,
+                        ha='center', va='center', color=self.app.text_color)
+                ax.set_xticks([], [])
+                ax.set_yticks([], [])
+            fig.tfr_drawn = False
+            return
 
-        # Return value
-        self.returnValue = None
+        extent = (tf.times[0], tf.times[-1], -0.5, len(tf.freqs) - 0.5)
+        ticks = np.unique(np.linspace(0, len(tf.freqs) - 1, 5).round().astype(int))
+        ersp, itc = result
+        vlim = max(float(np.max(np.abs(ersp))), 1e-3)
+        images = [
+            ax_ersp.imshow(ersp, aspect='auto', origin='lower', extent=extent, cmap='RdBu_r', vmin=-vlim, vmax=vlim),
+            ax_itc.imshow(itc, aspect='auto', origin='lower', extent=extent, cmap=self.app.parameters['cmap'],
+                          vmin=0, vmax=max(float(itc.max()), 1e-3)),
+        ]
+        for ax, im in zip(fig.tfr_axes, images):
+            ax.set_yticks(ticks, [f'{tf.freqs[i]:.0f}' for i in ticks])
+            ax.set_ylabel('Frequency (Hz)')
+            if tf.times[0] < 0 < tf.times[-1]:
+                ax.axvline(0, color='k', linestyle='--', alpha=0.5)
+            fig.colorbar(im, ax=ax)
+        ax_itc.set_xlabel('Time (s)')
+        fig.tfr_drawn = True
+
+    def plot_butterfly(self, ax, exclude, comp):
+        # Patch the existing traces instead of rebuilding the whole plot
+        data = self.app.butterfly_data(exclude, comp)
+        lines = getattr(ax, 'butterfly_lines', None)
+        if lines is not None:
+            picks = mne.pick_types(self.app.info, eeg=True, exclude='bads')
+            for line, trace in zip(lines, data[picks] * 1e6):
+                line.set_ydata(trace)
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+            return
 
-        # User Parameters
-        self.parameters = {
+        ax.clear()
+        evoked = mne.EvokedArray(data, self.app.info,
+                                 tmin=self.app.epochs.times[0],
+                                 nave=1 if self.app.continuous else self.app.variance_engine.nave,
+                                 verbose=False)
+        if self.app.parameters['interactive_butterfly']:
+            evoked.plot(axes=ax, show=False)
+        else:
+            evoked.plot(axes=ax, show=False, selectable=False)
+        ax.butterfly_lines = list(ax.lines)
+
+# %% Headless Export
+class ICASharedArrays:
+    # Numpy arrays placed in shared memory once and attached by name in the
+    # export workers, so the sources are never pickled or copied per process.
+    # Memory-mapped arrays (low_memory) are shared through their file instead.
+    def __init__(self, blocks, specs):
+        self.blocks = blocks
+        self.specs = specs
+        self.arrays = {}
+        for name, (block, shape, dtype, filename, offset) in specs.items():
+            if filename is not None:
+                self.arrays[name] = np.memmap(filename, dtype=dtype, mode='r', shape=shape, offset=offset)
+            else:
+                self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+
+    @classmethod
+    def create(cls, arrays):
+        blocks, specs = {}, {}
+        for name, array in arrays.items():
+            if isinstance(array, np.memmap) and array.filename is not None and array.flags.c_contiguous:
+                specs[name] = (None, array.shape, array.dtype.str, array.filename, array.offset)
+                continue
+            array = np.ascontiguousarray(array)
+            blocks[name] = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            specs[name] = (blocks[name].name, array.shape, array.dtype.str, None, 0)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=blocks[name].buf)[...] = array
+        return cls(blocks, specs)
+
+    @classmethod
+    def attach(cls, specs):
+        blocks = {name: shared_memory.SharedMemory(name=spec[0])
+                  for name, spec in specs.items() if spec[0] is not None}
+        return cls(blocks, specs)
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+class ICAExporter:
+    # Renders the overview and every component page to disk, without Qt. The
+    # numeric inputs are computed once in the parent; the large arrays (sources,
+    # spectra, topomap images) go to the workers through shared memory and the
+    # rest (engine, interpolator, parameters) is pickled once per worker.
+    worker = None # ICAData of the current worker process
+
+    def __init__(self, ica, epochs, path,
+                 cmap='turbo',
+                 apply_baseline=True,
+                 psd_xlim=[None, None],
+                 overview_avg_xlim=[None, None],
+                 bg_alpha=1,
+                 psd_method='multitaper',
+                 low_memory=False,
+                 source_dtype='float64',
+                 memmap_dir=None,
+                 cache_dir=None,
+                 cache_max_mb=4096,
+                 segment_duration=2.,
+                 tfr=False,
+                 tfr_freqs=None,
+                 tfr_decim=None,
+                 templates=None,
+                 template_threshold=0.8,
+                 formats=('png',),
+                 size=(1600, 1200),
+                 dpi=100,
+                 n_jobs=None):
+        self.path = path
+        self.formats = [fmt.lower().lstrip('.') for fmt in formats]
+        self.size = tuple(size)
+        self.dpi = dpi
+        if n_jobs is None:
+            n_jobs = max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.n_jobs = n_jobs
+
+        self.data = ICAData()
+        self.data.parameters = {
             'cmap': cmap,
             'psd_xlim': psd_xlim,
-            'interactive_butterfly': interactive_butterfly,
+            'interactive_butterfly': False,
             'bg_alpha': bg_alpha,
             'overview_avg_xlim': overview_avg_xlim,
+            'psd_method': psd_method,
+            'low_memory': low_memory,
+            'source_dtype': source_dtype,
+            'memmap_dir': memmap_dir,
+            'cache_dir': cache_dir,
+            'cache_max_mb': cache_max_mb,
+            'segment_duration': segment_duration,
+            'tfr': tfr,
+            'tfr_freqs': tfr_freqs,
+            'tfr_decim': tfr_decim,
+            'templates': templates,
+            'template_threshold': template_threshold,
+            'tfr_cache_mb': 0, # every page is drawn once
+            'profile': False,
         }
-
-        # Get the source signals for all components
-        source_epochs = self.ica.get_sources(epochs)
-        self.source_data = source_epochs.get_data()
-
-        # Plot Control
-        self.dataset_is_updated = [False] * (self.n_components)
-        self.component_is_updated = [False] * (self.n_components)
-        self.changing_component = None
-
-        # Setting Parameters to Plot Styles and Colors
-        self.plot_style_and_colors()
-
-        # Initializing UI
-        self.initUI()
-        self.figure_is_empty = [True] * (self.n_components + 1)
-
-        # Move existing components to the bad list
-        self.exclude_items()
-
-        # Blocking Dialog
-        self.dialog = ICABlockingDialog(self)
-
-        # Worker Thread
-        self.thread = ICAWorkerThread(self)
-        self.thread.finished_signal.connect(self.update_plot)
-        self.thread.finished_signal.connect(self.dialog.close)
-
-        # Make UI Pop UP
-        self.show()
-        self.activateWindow()
-        self.raise_()
-        self.setWindowState(Qt.WindowActive)
-        self.showMaximized()
-        
-        # Request Update
-        self.request_update()
-        
-    def initUI(self):
-        # Setting up layouts
-        main_layout = QHBoxLayout()
-        left_layout = self.setup_left_layout()
-        right_layout = self.setup_right_layout()
-
-        # Adding layouts to main layout
-        main_layout.addLayout(left_layout)
-        main_layout.addLayout(right_layout)
-
-        # Set the layout
-        self.setLayout(main_layout)
-
-        # Set buttons starting state
-        self.button_left.setEnabled(False)
-        self.button_left.setText('Overview')
-        self.button_right.setText('Single Component Vizualization')
-        self.button_right.setToolTip('Go to single component vizualization')
-
-    def setup_left_layout(self):
-        left_layout = QVBoxLayout()
-
-        # Labels
-        self.good_label = self.create_centered_label('Kept Components')
-        self.bad_label = self.create_centered_label('Removed Components')
-
-        # List widgets
-        self.list1 = self.create_list_widget(self.move_item_to_list2)
-        self.list2 = self.create_list_widget(self.move_item_to_list1)
-        for item in self.ica_labels:
-            list_item1 = QListWidgetItem(item)
-            list_item1.setTextAlignment(Qt.AlignCenter)
-            self.list1.addItem(list_item1)
-
-        # Buttons
-        self.change_component_button = self.create_button('Remove/Restore [R]', self.change_item, 'R', 'Drop/Restore the selected component\n(Shortcut: R)')
-        self.home_button = self.create_button('Home [H]', self.go_home, 'H', 'Go to the overview page\n(Shortcut: H)')
-        self.show_button = self.create_button('Show [S]', self.show_item, 'S', 'Show the selected component\n(Shortcut: S)')
-        self.save_ica_button = self.create_button('Save ICA', self.save_ica, 'Ctrl+S', 'Save the ICA object\n(Shortcut: Ctrl+S)')
-        self.save_figure_button = self.create_button('Save Figure', self.save_figure, 'Ctrl+Shift+S', 'Save the current figure\n(Shortcut: Ctrl+Shift+S)')
-
-        # Watermark
-        watermark = QLabel("Couto, B.A.N. ICApp (2023).", self)
-        watermark.setStyleSheet("color: rgba(200, 200, 200, 128); font-size: 8px;")
-        watermark.setAlignment(Qt.AlignCenter | Qt.AlignBottom)
-
-        # Add widgets to left layout
-        widgets = [
-            self.good_label,
-            self.list1,
-            self.bad_label,
-            self.list2,
-            self.change_component_button,
-            self.home_button,
-            self.show_button,
-            self.save_ica_button,
-            self.save_figure_button,
-            watermark]
-        
-        for w in widgets:
-            if isinstance(w, QWidget):
-                w.setMaximumWidth(150)
-                left_layout.addWidget(w)
+        self.data.setup_data(ica, epochs, apply_baseline)
+        self.data.load_all()
+
+    def worker_state(self):
+        data = self.data
+        names = ['parameters', 'n_components', 'label_digits', 'ica_labels', 'exclude', 'variance_engine',
+                 'spectra', 'topomaps', 'topomap_vlim', 'n_loaded', 'data_version', 'continuous', 'segment_summary',
+                 'info']
+        state = {name: getattr(data, name) for name in names}
+        state['epochs'] = data.epochs[:1].load_data() # times and info only
+        if data.continuous: # the workers cannot read the recording, give them the segments they draw
+            state['segment_starts'] = data.segment_starts
+            state['segment_cache'] = OrderedDict((segment, data.segment(segment)) for segment in
+                                                 np.unique(data.segment_summary.arrays['peak_segment']))
+        state['export_snapshot'] = data.snapshot()
+        state['export_output'] = (self.path, self.formats, self.size, self.dpi)
+        return state
+
+    @staticmethod
+    def init_worker(specs, state, backend='agg'):
+        if backend is not None:
+            import matplotlib.pyplot as plt
+            plt.switch_backend(backend)
+        data = ICAData()
+        data.shared = ICASharedArrays.attach(specs) if isinstance(specs, dict) else specs
+        data.__dict__.update(state)
+        data.source_data = data.shared.arrays['source_data']
+        data.topomap_images = data.shared.arrays['topomap_images']
+        data.psd_cache = {data.spectra.key: data.shared.arrays['psd']}
+        data.evoked_cache = ICAEvokedCache(data.variance_engine)
+        data.trial_images = TrialImageLOD(data.source_data)
+        data.figure_is_empty = [True] * (data.n_components + 1)
+        data.page_versions = [None] * (data.n_components + 1)
+        data.profiler = ICAProfiler(data.parameters['profile'])
+        data.segment_lock = threading.Lock()
+        data.setup_time_frequency()
+        data.setup_style()
+        ICAExporter.worker = data
+
+    @staticmethod
+    def render_page(page):
+        from matplotlib.figure import Figure
+        import matplotlib.image
+        data = ICAExporter.worker
+        path, formats, size, dpi = data.export_output
+        name = 'overview' if page == 0 else 'component_' + str(page).zfill(data.label_digits)
+
+        fig = Figure(layout='constrained')
+        image = ICAPageRenderer(data).render(fig, page, data.export_snapshot, size, dpi)
+        files = {}
+        for fmt in formats:
+            files[fmt] = name + '.' + fmt
+            if fmt == 'png':
+                matplotlib.image.imsave(os.path.join(path, files[fmt]), image, dpi=dpi)
             else:
-                left_layout.addLayout(w)
-
-        return left_layout
+                fig.savefig(os.path.join(path, files[fmt]), format=fmt, dpi=dpi)
 
-    def setup_right_layout(self):
-        right_layout = QVBoxLayout()
-
-        # Navigation buttons
-        self.button_left = self.create_button('<', self.go_left, QtGui.QKeySequence(Qt.CTRL + Qt.Key_Left), 'Go to the previous page\n(Shortcut: Ctrl+Left)')
-        self.button_right = self.create_button('>', self.go_right, QtGui.QKeySequence(Qt.CTRL + Qt.Key_Right), 'Go to the next page\n(Shortcut: Ctrl+Right)')
-
-        # Number input
-        self.page_number_input = QLineEdit(self)
-        self.page_number_input.setFixedWidth(50)
-        self.page_number_input.setAlignment(Qt.AlignCenter)
-        self.page_number_input.returnPressed.connect(self.go_to_page)
-
-        # Add navigation widgets to layout
-        nav_button_layout = QHBoxLayout()
-        for widget in [self.button_left, self.page_number_input, self.button_right]:
-            nav_button_layout.addWidget(widget)
-        right_layout.addLayout(nav_button_layout)
-
-        # Pages
-        self.setup_pages()
-
-        # Add stacked widget to layout
-        right_layout.addWidget(self.stacked_widget)
-
-        return right_layout
-
-    def setup_pages(self):
-        self.stacked_widget = QStackedWidget()
-        self.labels = []
-        self.figures = []
-        self.canvases = []
-
-        # Overview page
-        page, label, fig, canvas = self.create_page('Overview')
-        self.labels.append(label)
-        self.figures.append(fig)
-        self.canvases.append(canvas)
-        self.stacked_widget.addWidget(page)
-
-        # Component pages
-        for item in self.ica_labels:
-            page, label, fig, canvas = self.create_page(item)
-            self.labels.append(label)
-            self.figures.append(fig)
-            self.canvases.append(canvas)
-            self.stacked_widget.addWidget(page)
-
-    def create_page(self, title):
-        page = QWidget()
-        page_layout = QVBoxLayout()
-        label = self.create_centered_label(title)
-        fig = Figure(figsize=(10, 10), layout='constrained')
-        canvas = FigureCanvas(fig)
-        page_layout.addWidget(label)
-        page_layout.addWidget(canvas)
-        page.setLayout(page_layout)
-        return page, label, fig, canvas
-
-    def create_button(self, text, slot, shortcut=None, tooltip=None):
-        btn = QPushButton(text, self)
-        btn.clicked.connect(slot)
-        if shortcut is not None:
-            QShortcut(QtGui.QKeySequence(shortcut), self).activated.connect(slot)
-        if tooltip is not None:
-            btn.setToolTip(tooltip)
-        return btn
-
-    def create_centered_label(self, text):
-        label = QLabel(text)
-        label.setAlignment(Qt.AlignCenter)
-        return label
-
-    def create_list_widget(self, double_click_slot):
-        list_widget = QListWidget()
-        list_widget.setSortingEnabled(True)
-        list_widget.itemDoubleClicked.connect(double_click_slot)
-        return list_widget
-
-    def go_home(self):
-        self.page_number_input.setText('Home')
-        self.switch_to_page(0)
-
-    def show_item(self):
-        current_widget = QApplication.focusWidget()
-        current_item = None
-
-        if current_widget in [self.list1, self.list2] and current_widget.selectedItems():
-            current_item = current_widget.selectedItems()[0]
-
-        if current_item is not None:
-            try:
-                index = self.ica_labels.index(current_item.text())
-                self.switch_to_page(index + 1)
-            except ValueError:
-                pass
+        # Pages are built once per process, so the figures are released as we go
+        fig.clear()
+        data.figure_is_empty[page] = True
+        data.page_versions[page] = None
+        return page, files
 
-    def change_item(self):
-        current_widget = QApplication.focusWidget()
-        current_item = None
-
-        if current_widget in [self.list1, self.list2] and current_widget.selectedItems():
-            current_item = current_widget.selectedItems()[0]
-
-        if current_item is not None:
-            if current_widget == self.list1:
-                self.move_item_to_list2()
+    def run(self):
+        import matplotlib
+        os.makedirs(self.path, exist_ok=True)
+        data = self.data
+        shared = ICASharedArrays.create({
+            'source_data': data.source_data,
+            'topomap_images': data.topomap_images,
+            'psd': data.psd_cache[data.spectra.key],
+        })
+        state = self.worker_state()
+        pages = range(data.n_components + 1)
+        files = {}
+        try:
+            if self.n_jobs == 1:
+                with matplotlib.rc_context():
+                    ICAExporter.init_worker(shared, state, backend=None)
+                    for page in pages:
+                        page, files[page] = ICAExporter.render_page(page)
+                ICAExporter.worker = None
             else:
-                self.move_item_to_list1()
-
-    def move_item_to_list2(self):
-        current_item = self.list1.currentItem()
-        if current_item is not None:
-            self.list1.takeItem(self.list1.row(current_item))
-            self.list2.addItem(current_item)
-            self.ica.exclude = self.get_bads()
-            self.changing_component = int(current_item.text()[-3:])-1
-            self.request_update()
-
-    def move_item_to_list1(self):
-        current_item = self.list2.currentItem()
-        if current_item is not None:
-            self.list2.takeItem(self.list2.row(current_item))
-            self.list1.addItem(current_item)
-            self.ica.exclude = self.get_bads()
-            self.changing_component = int(current_item.text()[-3:])-1
-            self.request_update()
-
-    def go_left(self):
-        current_index = self.stacked_widget.currentIndex()
-        if current_index > 0:
-            self.switch_to_page(current_index - 1)
-
-    def go_right(self):
-        current_index = self.stacked_widget.currentIndex()
-        if current_index < self.stacked_widget.count() - 1:
-            self.switch_to_page(current_index + 1)
-
-    def go_to_page(self):
-        page_number = self.page_number_input.text()
-        if not page_number.isdigit():
-            return
-        
-        page_number = int(page_number)
-
-        if 0 <= page_number < self.n_components:
-            self.switch_to_page(page_number)
-
-    def switch_to_page(self, i):
-        self.stacked_widget.setCurrentIndex(i)
-        self.page_number_input.setText(str(i))
-        self.current_page = i
-        if i == 0:
-            self.button_left.setEnabled(False)
-            self.button_left.setText('Overview')
-            self.button_right.setText('Single Component Vizualization')
-            self.button_right.setToolTip('Go to single component vizualization')
-        elif i==1:
-            self.button_left.setEnabled(True)
-            self.button_left.setText('Overview')
-            self.button_left.setToolTip('Go to the overview component')
-            self.button_right.setEnabled(True)
-            self.button_right.setText('Next >')
-            self.button_right.setToolTip('Go to the next component')
-        elif i==self.n_components:
-            self.button_left.setEnabled(True)
-            self.button_left.setText('< Previous')
-            self.button_left.setToolTip('Go to the previous component')
-            self.button_right.setEnabled(False)
-            self.button_right.setText('Last Component')
+                with ProcessPoolExecutor(self.n_jobs, initializer=ICAExporter.init_worker,
+                                         initargs=(shared.specs, state)) as pool:
+                    futures = [pool.submit(ICAExporter.render_page, page) for page in pages]
+                    for future in as_completed(futures):
+                        page, files[page] = future.result()
+        finally:
+            shared.close(unlink=True)
+
+        index = self.write_index(files)
+        return index
+
+    def write_index(self, files):
+        data = self.data
+        snapshot = data.snapshot()
+        index = {
+            'n_components': int(data.n_components),
+            'exclude': snapshot['exclude'],
+            'explained_variance': float(snapshot['explained_variance']),
+            'parameters': {name: value.tolist() if isinstance(value, np.ndarray) else value # e.g. tfr_freqs
+                           for name, value in data.parameters.items()},
+            'pages': [{'page': 0, 'title': 'Overview', 'files': files[0]}],
+        }
+        for comp in range(data.n_components):
+            index['pages'].append({
+                'page': comp + 1,
+                'component': comp,
+                'title': data.ica_labels[comp],
+                'excluded': bool(snapshot['excluded'][comp]),
+                'explained_variance_without': float(snapshot['explained_variance_with_each'][comp]),
+                'metrics': {name: (None if np.isnan(values[comp]) else float(values[comp]))
+                            for name, values in data.metrics.items()},
+                'template': data.template_matches.get(comp, (None,))[0],
+                'files': files[comp + 1],
+            })
+        with open(os.path.join(self.path, 'index.json'), 'w') as f:
+            json.dump(index, f, indent=2)
+
+        # Minimal report to page through the images in a browser
+        fmt = 'png' if 'png' in self.formats else self.formats[0]
+        rows = []
+        for entry in index['pages']:
+            color = 'red' if entry.get('excluded') else 'black'
+            src = html.escape(entry['files'][fmt])
+            rows.append(f'<h2 id="page{entry["page"]}" style="color:{color}">{html.escape(entry["title"])}</h2>\n'
+                        f'<a href="{src}"><img src="{src}" style="max-width:100%"></a>')
+        with open(os.path.join(self.path, 'index.html'), 'w') as f:
+            f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>ICApp</title></head><body>\n')
+            f.write(f'<p>Excluded: {index["exclude"]} &mdash; explained variance {index["explained_variance"]:.2f}%</p>\n')
+            f.write('\n'.join(rows))
+            f.write('\n</body></html>\n')
+        return index
+
+# %% Cleaned Data Export
+class ICACleanWriter:
+    # Writes the cleaned epochs (or raw) of an exclude set to .npy or FIF without
+    # ica.apply and without a second in-memory copy: chunks of epochs are cleaned
+    # with ICAReconstruction.clean (only the excluded rank is subtracted, using
+    # the precomputed sources when given) by a thread pool and written into a
+    # memory-mapped output. FIF files are saved from that memmap and it is
+    # removed afterwards; MNE writes each FIF part of an Epochs file in one go,
+    # so split_size bounds that last buffer. Continuous data is chunked in
+    # chunk_duration seconds. picks limits the written channels (all by default).
+    def __init__(self, ica, inst, exclude=None, source_data=None, chunk_size=64,
+                 chunk_duration=10., n_jobs=None, memmap_dir=None, split_size='2GB', picks=None):
+        self.inst = inst
+        self.continuous = isinstance(inst, mne.io.BaseRaw)
+        self.exclude = np.sort(ica.exclude if exclude is None else exclude).astype(int).tolist()
+        self.picks = np.arange(len(inst.ch_names)) if picks is None else np.asarray(picks)
+        self.info = mne.pick_info(inst.info, self.picks)
+        self.reconstruction = ICAReconstruction(ica, self.info.ch_names)
+        self.source_data = None if self.continuous else source_data
+        self.memmap_dir = memmap_dir
+        self.split_size = split_size
+        self.n_jobs = n_jobs if n_jobs is not None else max(1, min(4, (os.cpu_count() or 1) - 1))
+        self.read_lock = threading.Lock() # lazy inputs read from one file
+        self.cancelled = False
+
+        # Chunks: epoch ranges, or sample ranges of the raw data
+        if self.continuous:
+            n, step = inst.n_times, max(1, int(round(chunk_duration * inst.info['sfreq'])))
+            self.shape = (len(self.picks), n)
         else:
-            self.button_left.setEnabled(True)
-            self.button_left.setText('< Previous')
-            self.button_left.setToolTip('Go to the previous component')
-            self.button_right.setEnabled(True)
-            self.button_right.setText('Next >')
-            self.button_right.setToolTip('Go to the next component')
-        self.request_update()
-
-    def request_update(self):
-        # Get Index
-        # index = self.stacked_widget.currentIndex()
-        # print(f'Requesting update ({index})')
-
-        self.thread.start()
-        self.dialog.exec_()
-
-    def update_plot(self):
-        # Get Index
-        index = self.stacked_widget.currentIndex()
-        # print(f'Updating plot ({index})')
-        canvas = self.canvases[index]
-        canvas.draw()
-
-    def get_bads(self):
-        bad_items = []
-        for index in range(self.list2.count()):
-            bad_items.append(self.list2.item(index).text())
-        bads = [int(bad_item[-3:])-1 for bad_item in bad_items]
-        return bads
-
-    def exclude_items(self):
-        # iterate over the items in the 'good' list in reverse order
-        for i in range(self.list1.count()-1, -1, -1):
-            item = self.list1.item(i)
-
-            # if the item's text is in the exclude list, move it to the 'bad' list
-            if int(item.text()[-3:])-1 in self.exclude:
-                self.list1.takeItem(i)
-                list_item = QListWidgetItem(item.text())
-                list_item.setTextAlignment(Qt.AlignCenter)
-                self.list2.addItem(list_item)
-
-        # re-sort the lists
-        self.list1.sortItems()
-        self.list2.sortItems()
-
-    def plot_style_and_colors(self):
-        palette = QApplication.palette()
-        bg_color = palette.color(QtGui.QPalette.Background)
-        self.bg_color = bg_color.name()
-        text_color = palette.color(QtGui.QPalette.WindowText)
-        self.text_color = text_color.name()
-
-        # Plot Visual Parameters
-        plt.rcParams.update({
-            'font.family': 'sans-serif',
-            'font.sans-serif': 'Arial',
-            'font.size': 8,
-            'axes.titlesize': 10,
-            'axes.labelsize': 8,
-            'xtick.labelsize': 8,
-            'ytick.labelsize': 8,
-            'text.color': self.text_color,
-            'axes.labelcolor': self.text_color,
-            # 'axes.edgecolor': (self.text_color),
-            # 'xtick.color': self.text_color,
-            # 'ytick.color': self.text_color,
-            'figure.facecolor': self.bg_color,
-            'axes.facecolor': (1,1,1,self.parameters['bg_alpha'])})
-
-    def save_figure(self):
-        # Get Index
-        index = self.stacked_widget.currentIndex()
-        # print(f'Saving figure ({index})')
-
-        # Get the current figure and canvas
-        fig = self.figures[index]
-
-        # Save the figure
-        options = QFileDialog.Options()
-        fileName, _ = QFileDialog.getSaveFileName(self, "Save Figure", "", "PNG Files (*.png);;JPEG Files (*.jpg);; SVG Files (*.svg);;All Files (*)", options=options)
-        if fileName:
-            fig.savefig(fileName)
-
-    def save_ica(self):
-        # Save the figure
-        options = QFileDialog.Options()
-        fileName, _ = QFileDialog.getSaveFileName(self, "Save ICA", "", "ICA Files (*-ica.fif);;;;All Files (*)", options=options)
-        if fileName:
-            if not fileName.endswith('-ica.fif'):
-                fileName += '-ica.fif'
-            self.ica.save(fileName, overwrite=True)
-
-    def closeEvent(self, event):
-        plt.close('all')
-        self.ica.exclude = self.get_bads()
-        self.returnValue = self.ica
-        event.accept()
+            n, step = len(inst), chunk_size
+            self.shape = (n, len(self.picks), len(inst.times))
+        self.chunks = [(start, min(start + step, n)) for start in range(0, n, step)]
+
+    def read(self, start, stop):
+        if self.inst.preload:
+            return self.get_data(start, stop)
+        with self.read_lock:
+            return self.get_data(start, stop)
+
+    def get_data(self, start, stop):
+        if self.continuous:
+            return self.inst.get_data(picks=self.picks, start=start, stop=stop)[None]
+        return self.inst.get_data(picks=self.picks, item=slice(start, stop), verbose=False)
+
+    def clean_chunk(self, output, start, stop):
+        if self.cancelled:
+            return 0
+        data = self.read(start, stop)
+        sources = None
+        if self.source_data is not None and self.exclude:
+            sources = np.asarray(self.source_data[start:start + len(data), self.exclude], dtype=float)
+        cleaned = self.reconstruction.clean(data, self.exclude, sources)
+        if self.continuous:
+            output[:, start:stop] = cleaned[0]
+        else:
+            output[start:stop] = cleaned
+        return stop - start
+
+    def write(self, path, progress=None):
+        # progress(n_done, n_total) is called from the worker threads
+        fif = not path.endswith('.npy')
+        if fif:
+            f = tempfile.NamedTemporaryFile(prefix='icapp-clean-', suffix='.dat',
+                                            dir=self.memmap_dir, delete=False)
+            f.close()
+            output = np.memmap(f.name, dtype=float, mode='w+', shape=self.shape)
+        else:
+            output = np.lib.format.open_memmap(path, mode='w+', dtype=float, shape=self.shape)
+        try:
+            n_done, n_total = 0, self.shape[-1] if self.continuous else self.shape[0]
+            with ThreadPoolExecutor(self.n_jobs) as pool:
+                futures = [pool.submit(self.clean_chunk, output, start, stop) for start, stop in self.chunks]
+                for future in as_completed(futures):
+                    n_done += future.result()
+                    if progress is not None and not self.cancelled:
+                        progress(n_done, n_total)
+            if self.cancelled:
+                return None
+            output.flush()
+            if fif:
+                self.save_fif(output, path)
+        finally:
+            del output
+            if fif:
+                ICAData.remove_file(f.name)
+            elif self.cancelled:
+                ICAData.remove_file(path)
+        return path
+
+    def save_fif(self, output, path):
+        inst = self.inst
+        if self.continuous:
+            cleaned = mne.io.RawArray(output, self.info, first_samp=inst.first_samp, verbose=False)
+            cleaned.set_annotations(inst.annotations)
+        else:
+            cleaned = mne.EpochsArray(output, self.info, events=inst.events, tmin=inst.tmin,
+                                      event_id=inst.event_id, metadata=inst.metadata, verbose=False)
+            cleaned.baseline = inst.baseline # as ica.apply: recorded, not applied again
+        cleaned.save(path, overwrite=True, split_size=self.split_size, verbose=False)
 
 # %% Application Calls:
+qt_app = None # Global variable to store the Qt Application
+journal_path = os.path.join(os.path.expanduser('~'), '.icapp', 'journal') # default ICADecisionJournal location
+def qt_module():
+    # ica_app_qt, next to this module (also when both are inside a package)
+    if __package__:
+        return importlib.import_module('.ica_app_qt', __package__)
+    return importlib.import_module('ica_app_qt')
+
 def ICApp(ica, epochs,
           cmap='turbo',
           apply_baseline = True,
           psd_xlim = [None, None],
           interactive_butterfly = False,
-          overview_avg_xlim = [None, None]):
+          overview_avg_xlim = [None, None],
+          psd_method = 'multitaper',
+          max_live_pages = 16,
+          pixmap_cache_mb = 256,
+          low_memory = False,
+          source_dtype = 'float64',
+          memmap_dir = None,
+          cache_dir = None,
+          cache_max_mb = 4096,
+          segment_duration = 2.,
+          tfr = False,
+          tfr_freqs = None,
+          tfr_decim = None,
+          templates = None,
+          template_threshold = 0.8,
+          journal_dir = journal_path,
+          tfr_cache_mb = 128,
+          profile = False):
     global qt_app
+    qt = qt_module()
+    QApplication, ICA_Application = qt.QApplication, qt.ICA_Application
 
     if qt_app is None:
         qt_app = QApplication(sys.argv)
@@ -692,7 +2281,24 @@ def ICApp(ica, epochs,
                          apply_baseline=apply_baseline,
                          psd_xlim=psd_xlim,
                          interactive_butterfly=interactive_butterfly,
-                         overview_avg_xlim=overview_avg_xlim)
+                         overview_avg_xlim=overview_avg_xlim,
+                         psd_method=psd_method,
+                         max_live_pages=max_live_pages,
+                         pixmap_cache_mb=pixmap_cache_mb,
+                         low_memory=low_memory,
+                         source_dtype=source_dtype,
+                         memmap_dir=memmap_dir,
+                         cache_dir=cache_dir,
+                         cache_max_mb=cache_max_mb,
+                         segment_duration=segment_duration,
+                         tfr=tfr,
+                         tfr_freqs=tfr_freqs,
+                         tfr_decim=tfr_decim,
+                         templates=templates,
+                         template_threshold=template_threshold,
+                         journal_dir=journal_dir,
+                         tfr_cache_mb=tfr_cache_mb,
+                         profile=profile)
     ex.show()
 
     try:
@@ -700,3 +2306,158 @@ def ICApp(ica, epochs,
     except SystemExit:
         pass
     return ex.returnValue
+
+def ICAppExport(ica, epochs, path,
+                cmap='turbo',
+                apply_baseline = True,
+                psd_xlim = [None, None],
+                overview_avg_xlim = [None, None],
+                psd_method = 'multitaper',
+                low_memory = False,
+                source_dtype = 'float64',
+                memmap_dir = None,
+                cache_dir = None,
+                cache_max_mb = 4096,
+                segment_duration = 2.,
+                tfr = False,
+                tfr_freqs = None,
+                tfr_decim = None,
+                templates = None,
+                template_threshold = 0.8,
+                formats = ('png',),
+                size = (1600, 1200),
+                dpi = 100,
+                n_jobs = None):
+    # Headless: writes every page to path (plus index.json/index.html) and
+    # returns the index
+    print('Exporting ICApp pages to ' + str(path) + '...')
+    exporter = ICAExporter(ica, epochs, path,
+                           cmap=cmap,
+                           apply_baseline=apply_baseline,
+                           psd_xlim=psd_xlim,
+                           overview_avg_xlim=overview_avg_xlim,
+                           psd_method=psd_method,
+                           low_memory=low_memory,
+                           source_dtype=source_dtype,
+                           memmap_dir=memmap_dir,
+                           cache_dir=cache_dir,
+                           cache_max_mb=cache_max_mb,
+                           segment_duration=segment_duration,
+                           tfr=tfr,
+                           tfr_freqs=tfr_freqs,
+                           tfr_decim=tfr_decim,
+                           templates=templates,
+                           template_threshold=template_threshold,
+                           formats=formats,
+                           size=size,
+                           dpi=dpi,
+                           n_jobs=n_jobs)
+    return exporter.run()
+
+def ICAppClean(ica, epochs, path, exclude=None, n_jobs=None, chunk_size=64, memmap_dir=None, split_size='2GB'):
+    # Saves the epochs (or raw) cleaned of exclude (default: ica.exclude) to
+    # path (.npy, or FIF for any other name), chunk by chunk and in parallel,
+    # computing only the excluded sources. Same data as ica.apply(epochs.copy()).
+    print('Writing cleaned data...')
+    writer = ICACleanWriter(ica, epochs, exclude=exclude, chunk_size=chunk_size,
+                            n_jobs=n_jobs, memmap_dir=memmap_dir, split_size=split_size)
+    return writer.write(path)
+
+def ICAppQueue(subjects,
+               save_dir = None,
+               on_done = None,
+               cmap='turbo',
+               apply_baseline = True,
+               psd_xlim = [None, None],
+               interactive_butterfly = False,
+               overview_avg_xlim = [None, None],
+               psd_method = 'multitaper',
+               max_live_pages = 16,
+               pixmap_cache_mb = 256,
+               low_memory = False,
+               source_dtype = 'float64',
+               memmap_dir = None,
+               cache_dir = None,
+               cache_max_mb = 4096,
+               segment_duration = 2.,
+               tfr = False,
+               tfr_freqs = None,
+               tfr_decim = None,
+               templates = None,
+               template_threshold = 0.8,
+               journal_dir = journal_path,
+               tfr_cache_mb = 128,
+               profile = False):
+    # Reviews several subjects one after another in one window. subjects is a
+    # list or generator of (ica, epochs) pairs, objects or file paths, with an
+    # optional name as third item. The next subject is read and precomputed in
+    # the background while the current one is reviewed. Each finished subject
+    # is saved to save_dir/<name>-ica.fif and/or passed to on_done(name, ica).
+    # Returns {name: ica} for the subjects reviewed.
+    global qt_app
+    qt = qt_module()
+    QApplication, ICAQueueWindow = qt.QApplication, qt.ICAQueueWindow
+
+    if qt_app is None:
+        qt_app = QApplication(sys.argv)
+
+    print('Running ICApp queue...')
+    window = ICAQueueWindow(subjects,
+                            save_dir=save_dir,
+                            on_done=on_done,
+                            apply_baseline=apply_baseline,
+                            cmap=cmap,
+                            psd_xlim=psd_xlim,
+                            interactive_butterfly=interactive_butterfly,
+                            overview_avg_xlim=overview_avg_xlim,
+                            psd_method=psd_method,
+                            max_live_pages=max_live_pages,
+                            pixmap_cache_mb=pixmap_cache_mb,
+                            low_memory=low_memory,
+                            source_dtype=source_dtype,
+                            memmap_dir=memmap_dir,
+                            cache_dir=cache_dir,
+                            cache_max_mb=cache_max_mb,
+                            segment_duration=segment_duration,
+                            tfr=tfr,
+                            tfr_freqs=tfr_freqs,
+                            tfr_decim=tfr_decim,
+                            templates=templates,
+                            template_threshold=template_threshold,
+                            journal_dir=journal_dir,
+                            tfr_cache_mb=tfr_cache_mb,
+                            profile=profile)
+
+    try:
+        qt_app.exec_()
+    except SystemExit:
+        pass
+    return window.results
+
+def read_subject(item, index):
+    # One queue entry, (ica, inst) or (ica, inst, name) with objects or file
+    # paths, -> (name, ica, inst). Epochs files are read lazily.
+    ica, inst = item[0], item[1]
+    name = item[2] if len(item) > 2 else None
+    if isinstance(ica, (str, os.PathLike)):
+        path = os.fspath(ica)
+        if name is None:
+            name = os.path.basename(path).split('-ica')[0].split('_ica')[0].split('.fif')[0]
+        ica = mne.preprocessing.read_ica(path, verbose=False)
+    if isinstance(inst, (str, os.PathLike)):
+        path = os.fspath(inst)
+        if os.path.basename(path).endswith(('-epo.fif', '_epo.fif', '-epo.fif.gz', '_epo.fif.gz')):
+            inst = mne.read_epochs(path, preload=False, verbose=False)
+        else:
+            inst = mne.io.read_raw(path, preload=False, verbose=False)
+    if name is None:
+        name = 'subject_' + str(index + 1).zfill(3)
+    return name, ica, inst
+
+def __getattr__(name):
+    # The Qt classes (ICA_Application, ICARenderScheduler, ...) used to live in
+    # this module; they are still reachable from here, importing Qt on first use
+    if name in ('ICALoadThread', 'ICARenderSignals', 'ICARenderJob', 'ICAPixmapCache',
+                'ICARenderScheduler', 'ICA_Application', 'ICAPreloadThread', 'ICAQueueWindow'):
+        return getattr(qt_module(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,1237 @@
+# Author: Couto, B.A.N.
+# Date: August 2023
+# ICA Application for MNE-Python (Qt interface, imported by ica_app.ICApp)
+
+# %% Imports
+from collections import OrderedDict
+import os
+import numpy as np
+
+# Plots
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+# Qt5 Imports
+from PyQt5 import QtGui
+from PyQt5.QtWidgets import QApplication, QWidget, QSizePolicy, QVBoxLayout, QHBoxLayout, QPushButton, QStackedWidget, QLabel, QTableView, QAbstractItemView, QHeaderView, QLineEdit, QShortcut, QFileDialog, QInputDialog, QPlainTextEdit, QScrollBar
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThread, QThreadPool, QTimer, QAbstractTableModel, QModelIndex, QSortFilterProxyModel, pyqtSignal
+
+if __package__: # both modules inside a package
+    from .ica_app import ICAData, ICAMetrics, ICAPageRenderer, ICATemplateLibrary, journal_path, read_subject
+else:
+    from ica_app import ICAData, ICAMetrics, ICAPageRenderer, ICATemplateLibrary, journal_path, read_subject
+
+# %% Threads
+class ICALoadThread(QThread):
+    # Loads the remaining epoch blocks while the window is already up
+    progress_signal = pyqtSignal(int)
+    finished_signal = pyqtSignal(dict)
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.cancelled = False
+
+    def run(self):
+        while not self.app.loaded and not self.cancelled:
+            self.progress_signal.emit(self.app.load_block())
+        self.finished_signal.emit({'loaded': self.app.loaded})
+        if not self.cancelled:
+            self.app.save_cache()
+
+class ICACleanThread(QThread):
+    # Writes the cleaned data of an exclude set (ICAData.write_cleaned)
+    progress_signal = pyqtSignal(int, int)
+    finished_signal = pyqtSignal(dict)
+
+    def __init__(self, app, path, exclude):
+        super().__init__()
+        self.app = app
+        self.path = path
+        self.exclude = exclude
+
+    def run(self):
+        try:
+            path = self.app.write_cleaned(self.path, self.exclude, progress=self.progress_signal.emit)
+        except Exception as error:
+            self.finished_signal.emit({'path': None, 'error': error})
+            return
+        self.finished_signal.emit({'path': path})
+
+class ICAPreloadThread(QThread):
+    # Reads the next queue entry and precomputes it headlessly (sources,
+    # statistics, spectra, metrics) while the current subject is reviewed
+    finished_signal = pyqtSignal(dict)
+
+    def __init__(self, subjects, index, parameters, apply_baseline=True):
+        super().__init__()
+        self.subjects = subjects
+        self.index = index
+        self.parameters = dict(parameters)
+        self.apply_baseline = apply_baseline
+        self.cancelled = False
+
+    def run(self):
+        item = next(self.subjects, None)
+        if item is None:
+            self.finished_signal.emit({'done': True})
+            return
+        name = 'subject_' + str(self.index + 1).zfill(3)
+        try:
+            name, ica, inst = read_subject(item, self.index)
+            data = ICAData()
+            data.parameters = self.parameters
+            data.setup_data(ica, inst, self.apply_baseline)
+            while not data.loaded and not self.cancelled:
+                data.load_block()
+            if not self.cancelled:
+                data.refresh_data()
+                data.save_cache()
+        except Exception as error:
+            self.finished_signal.emit({'done': False, 'name': name, 'error': error})
+            return
+        self.finished_signal.emit({'done': False, 'name': name, 'ica': ica, 'inst': inst, 'data': data})
+
+# %% Applications Classes
+class ICARenderSignals(QObject):
+    finished = pyqtSignal(dict)
+
+class ICARenderJob(QRunnable):
+    def __init__(self, renderer, fig, page, snapshot, size, dpi):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = ICARenderSignals()
+        self.renderer = renderer
+        self.fig = fig
+        self.page = page
+        self.snapshot = snapshot
+        self.size = size
+        self.dpi = dpi
+        self.cancelled = False
+
+    def run(self):
+        image = None
+        if not self.cancelled:
+            profiler = self.renderer.app.profiler
+            with profiler.span('render.job', page=self.page, version=self.snapshot['version']):
+                image = self.renderer.render(self.fig, self.page, self.snapshot, self.size, self.dpi)
+            profiler.sample_memory()
+
+        # emit the signal
+        data = {
+            'job': self,
+            'page': self.page,
+            'version': self.snapshot['version'],
+            'size': self.size,
+            'image': image,
+        }
+        self.signals.finished.emit(data)
+
+class ICAPixmapCache:
+    # Finished page bitmaps keyed by everything a page depends on (page, exclude
+    # set, size, dpi and plot parameters). Pages whose inputs did not change hit
+    # the cache; the least recently used bitmaps go once the budget is exceeded.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.cache = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def get(self, key):
+        pixmap = self.cache.get(key)
+        if pixmap is not None:
+            self.cache.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        if key in self.cache:
+            self.nbytes -= self.pixmap_bytes(self.cache.pop(key))
+        self.cache[key] = pixmap
+        self.nbytes += self.pixmap_bytes(pixmap)
+        while self.nbytes > self.max_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.nbytes -= self.pixmap_bytes(old)
+
+    def pixmap_bytes(self, pixmap):
+        return pixmap.width() * pixmap.height() * 4
+
+class ICARenderScheduler(QObject):
+    # Renders the current page first and then, speculatively, its neighbours and
+    # the components selected in the lists. Jobs that are no longer wanted are
+    # taken out of the queue (or have their result dropped if already running).
+    page_ready = pyqtSignal(int)
+
+    def __init__(self, app, max_workers=None):
+        super().__init__()
+        self.app = app
+        self.renderer = ICAPageRenderer(app)
+        self.pool = QThreadPool()
+        if max_workers is None:
+            max_workers = max(1, min(4, QThread.idealThreadCount() - 1))
+        self.pool.setMaxThreadCount(max_workers)
+        self.jobs = {} # page -> job (queued or running)
+        self.rendered = {} # page -> key of the last finished render
+        self.cache = ICAPixmapCache(app.parameters['pixmap_cache_mb'] * 2**20)
+        self.wanted = ([], None, None)
+        self.closed = False
+
+    def snapshot(self):
+        return self.app.snapshot()
+
+    def page_key(self, page, exclude, size, dpi):
+        parameters = repr(sorted(self.app.parameters.items()))
+        tfr = self.app.time_frequency is not None and page > 0 and self.app.time_frequency.ready(page - 1)
+        return (page, tuple(exclude), size, dpi, parameters, self.app.data_version, self.app.n_loaded, tfr)
+
+    def is_ready(self, page, key):
+        if key[2] is None: # interactive pages are not cached as bitmaps
+            return self.rendered.get(page) == key and page in self.app.page_widgets
+        return key in self.cache
+
+    def request(self, pages, size, dpi):
+        if self.closed:
+            return
+        snapshot = self.snapshot()
+        wanted = []
+        for page in pages:
+            if 0 <= page <= self.app.n_components and page not in wanted:
+                wanted.append(page)
+        keys = {page: self.page_key(page, snapshot['exclude'], size, dpi) for page in wanted}
+
+        # Cancel stale jobs
+        for page, job in list(self.jobs.items()):
+            if keys.get(page) != job.key:
+                job.cancelled = True
+                self.app.profiler.count('render.cancelled')
+                if self.pool.tryTake(job):
+                    del self.jobs[page]
+
+        # Show cached pages, queue what is missing, most important first
+        for priority, page in enumerate(wanted):
+            ready = self.is_ready(page, keys[page])
+            if size is not None:
+                if ready:
+                    self.cache.hits += 1
+                else:
+                    self.cache.misses += 1
+            if ready:
+                if page == self.app.current_page:
+                    self.app.get_page(page)
+                    self.app.show_page_image(page, self.cache.get(keys[page]))
+                continue
+            if page in self.jobs:
+                continue
+            self.app.get_page(page)
+            job = ICARenderJob(self.renderer, self.app.figures[page], page, snapshot, size, dpi)
+            job.key = keys[page]
+            job.signals.finished.connect(self.job_finished)
+            self.app.profiler.count('render.queued')
+            self.jobs[page] = job
+            self.pool.start(job, len(wanted) - priority)
+        self.wanted = (wanted, size, dpi)
+
+    def job_finished(self, data):
+        job = data['job']
+        page = data['page']
+        if self.jobs.get(page) is job:
+            del self.jobs[page]
+        if not job.cancelled:
+            pixmap = None
+            if data['image'] is not None:
+                image = data['image']
+                height, width, _ = image.shape
+                qimage = QtGui.QImage(image.data, width, height, 4 * width, QtGui.QImage.Format_RGBA8888)
+                pixmap = QtGui.QPixmap.fromImage(qimage)
+                pixmap.setDevicePixelRatio(job.dpi / 100)
+                self.cache.put(job.key, pixmap)
+            self.rendered[page] = job.key
+            self.app.show_page_image(page, pixmap)
+            self.page_ready.emit(page)
+        elif page in self.wanted[0]:
+            # A newer request for this page was waiting for this job
+            self.request(*self.wanted)
+
+    def shutdown(self):
+        # Results still on their way are dropped (the window may be deleted next)
+        self.closed = True
+        self.wanted = ([], None, None)
+        for job in self.jobs.values():
+            job.cancelled = True
+        self.pool.clear()
+        self.pool.waitForDone()
+
+class ICAComponentModel(QAbstractTableModel):
+    # One row per component: its label, the ICAMetrics columns and, with a
+    # template library, the template it matched. Whether a component is kept or
+    # removed is read from the exclude state, the Kept and Removed tables are
+    # two filtered views of this model.
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.columns = ['Component'] + list(app.metrics)
+        if app.template_library is not None:
+            self.columns.append('Template')
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.app.n_components
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        comp = index.row()
+        if index.column() == 0:
+            if role == Qt.DisplayRole:
+                return self.app.ica_labels[comp]
+            if role == Qt.UserRole:
+                return comp
+            return None
+        if self.columns[index.column()] == 'Template':
+            match = self.app.template_matches.get(comp)
+            if role == Qt.DisplayRole:
+                return '' if match is None else f'{match[0]} ({match[1]:.2f})'
+            if role == Qt.UserRole:
+                return float('-inf') if match is None else match[1]
+            return None
+        value = float(self.app.metrics[self.columns[index.column()]][comp])
+        if role == Qt.DisplayRole:
+            return '-' if np.isnan(value) else f'{value:.2f}'
+        if role == Qt.UserRole: # sort key, missing values last in descending order
+            if np.isnan(value):
+                return float('-inf')
+            return abs(value) if self.columns[index.column()].endswith(' r') else value
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation != Qt.Horizontal:
+            return None
+        if role == Qt.DisplayRole:
+            return self.columns[section]
+        if role == Qt.ToolTipRole:
+            if self.columns[section] == 'Template':
+                return 'Template of the library matched to the component, and its similarity'
+            return ICAMetrics.descriptions.get(self.columns[section])
+        return None
+
+    def components_changed(self, comps):
+        # Kept <-> removed: the filters re-check these rows only
+        if len(comps):
+            self.dataChanged.emit(self.index(min(comps), 0), self.index(max(comps), len(self.columns) - 1))
+
+    def metrics_changed(self):
+        self.dataChanged.emit(self.index(0, 0), self.index(self.app.n_components - 1, len(self.columns) - 1))
+
+class ICAComponentFilter(QSortFilterProxyModel):
+    # Kept (excluded=False) or removed (excluded=True) rows of the component model
+    def __init__(self, model, excluded):
+        super().__init__()
+        self.excluded = excluded
+        self.setSourceModel(model)
+        self.setSortRole(Qt.UserRole)
+
+    def filterAcceptsRow(self, row, parent):
+        return bool(self.sourceModel().app.exclude_state.excluded[row]) == self.excluded
+
+class ICAStatsPanel(QWidget):
+    # Live view of the profiler (profile=True): span timings, cache hit rates and
+    # memory, refreshed once a second, with a Chrome trace export
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.setWindowTitle('ICApp - Stats')
+        self.resize(640, 480)
+
+        self.text = QPlainTextEdit(self)
+        self.text.setReadOnly(True)
+        font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
+        self.text.setFont(font)
+
+        reset_button = QPushButton('Reset', self)
+        reset_button.clicked.connect(self.reset)
+        export_button = QPushButton('Export Trace', self)
+        export_button.clicked.connect(self.export)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(reset_button)
+        buttons.addWidget(export_button)
+        layout = QVBoxLayout()
+        layout.addWidget(self.text)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def refresh(self):
+        self.text.setPlainText(self.app.profiler.summary(self.app.cache_stats()))
+
+    def reset(self):
+        self.app.profiler.reset()
+        self.refresh()
+
+    def export(self):
+        options = QFileDialog.Options()
+        fileName, _ = QFileDialog.getSaveFileName(self, "Export Trace", "", "Chrome Trace (*.json);;All Files (*)", options=options)
+        if fileName:
+            self.app.profiler.export(fileName, self.app.cache_stats())
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+class ICATimeFrequencyJob(QRunnable):
+    # ERSP/ITC of one component, computed off the render pool so the rest of
+    # its page is never held up (the panel is filled in when this finishes)
+    def __init__(self, app, comp):
+        super().__init__()
+        self.app = app
+        self.comp = comp
+        self.signals = ICARenderSignals()
+
+    def run(self):
+        tf = self.app.time_frequency
+        if not tf.ready(self.comp): # may have been queued twice
+            with self.app.profiler.span('tfr', comp=self.comp):
+                tf.put(self.comp, tf.compute(self.app.source_data[:, self.comp, :]))
+        self.signals.finished.emit({'comp': self.comp})
+
+class ICAChunkPrefetch(QRunnable):
+    # Unmixes the source chunks around the visible window in the background
+    def __init__(self, chunks, start, stop):
+        super().__init__()
+        self.chunks = chunks
+        self.start = start
+        self.stop = stop
+
+    def run(self):
+        self.chunks.prefetch(self.start, self.stop)
+
+class ICASourceBrowser(QWidget):
+    # Scrolling view of the component time courses of a continuous recording.
+    # Only the visible window is unmixed (through the chunk cache), one more
+    # window on each side is prefetched in the background.
+    def __init__(self, app, n_visible=20, duration=10.):
+        super().__init__()
+        self.app = app
+        self.chunks = app.source_chunks
+        self.n_visible = min(n_visible, app.n_components)
+        self.window = max(1, int(round(duration * self.chunks.sfreq)))
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.setWindowTitle('ICApp - Sources')
+        self.resize(1200, 700)
+
+        # Traces
+        self.figure = Figure(layout='constrained')
+        self.canvas = FigureCanvas(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.ax.set_xlabel('Time (s)')
+        self.lines = [self.ax.plot([], [], linewidth=0.8)[0] for _ in range(self.n_visible)]
+
+        # Time and component scroll bars
+        self.time_bar = QScrollBar(Qt.Horizontal)
+        self.time_bar.setRange(0, max(0, self.chunks.n_times - self.window))
+        self.time_bar.setSingleStep(max(1, self.window // 10))
+        self.time_bar.setPageStep(self.window)
+        self.time_bar.valueChanged.connect(self.draw_window)
+        self.component_bar = QScrollBar(Qt.Vertical)
+        self.component_bar.setRange(0, app.n_components - self.n_visible)
+        self.component_bar.setPageStep(self.n_visible)
+        self.component_bar.valueChanged.connect(self.draw_window)
+
+        traces = QHBoxLayout()
+        traces.addWidget(self.canvas)
+        traces.addWidget(self.component_bar)
+        layout = QVBoxLayout()
+        layout.addLayout(traces)
+        layout.addWidget(self.time_bar)
+        self.setLayout(layout)
+
+        self.draw_window()
+
+    def scales(self):
+        # Standard deviation of every component over the epochs loaded so far
+        sums = self.app.metrics_engine.sums
+        n = float(sums['n_samples'])
+        mean, power = sums['moments'][0] / n, sums['moments'][1] / n
+        return np.sqrt(np.maximum(power - mean**2, np.finfo(float).tiny))
+
+    def draw_window(self):
+        sfreq = self.chunks.sfreq
+        start = self.time_bar.value()
+        stop = min(start + self.window, self.chunks.n_times)
+        first = self.component_bar.value()
+        comps = np.arange(first, min(first + self.n_visible, self.app.n_components))
+        with self.app.profiler.span('browser.window'):
+            data = self.chunks.get(start, stop)[comps]
+
+        # At most ~2000 points per trace, 3 standard deviations to half the spacing
+        step = max(1, (stop - start) // 2000)
+        times = (start + np.arange(0, stop - start, step)) / sfreq
+        data = data[:, ::step] / (6 * self.scales()[comps, None])
+        excluded = self.app.exclude_state.excluded
+        for i, line in enumerate(self.lines):
+            line.set_visible(i < len(comps))
+            if i < len(comps):
+                line.set_data(times, data[i] - i)
+                line.set_color('red' if excluded[comps[i]] else self.app.text_color)
+        self.ax.set_xlim(start / sfreq, (start + self.window) / sfreq)
+        self.ax.set_ylim(-self.n_visible + 0.5, 0.5)
+        self.ax.set_yticks(-np.arange(len(comps)), [self.app.ica_labels[comp] for comp in comps])
+        self.canvas.draw_idle()
+
+        # Neighbouring windows, replacing whatever was still queued
+        self.pool.clear()
+        self.pool.start(ICAChunkPrefetch(self.chunks, start - self.window, stop + self.window))
+
+    def closeEvent(self, event):
+        self.pool.clear()
+        self.pool.waitForDone()
+        super().closeEvent(event)
+
+class ICA_Application(QWidget, ICAData):
+    def __init__(self, ica, epochs,
+                 cmap='jet',
+                 apply_baseline = True,
+                 psd_xlim = [None, None],
+                 interactive_butterfly = True,
+                 overview_avg_xlim = [None, None],
+                 bg_alpha=1,
+                 psd_method='multitaper',
+                 max_live_pages=16,
+                 pixmap_cache_mb=256,
+                 low_memory=False,
+                 source_dtype='float64',
+                 memmap_dir=None,
+                 cache_dir=None,
+                 cache_max_mb=4096,
+                 segment_duration=2.,
+                 tfr=False,
+                 tfr_freqs=None,
+                 tfr_decim=None,
+                 templates=None,
+                 template_threshold=0.8,
+                 journal_dir=journal_path,
+                 tfr_cache_mb=128,
+                 profile=False,
+                 data=None,
+                 parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('ICApp')
+
+        # Return value
+        self.returnValue = None
+
+        # User Parameters
+        self.parameters = {
+            'cmap': cmap,
+            'psd_xlim': psd_xlim,
+            'interactive_butterfly': interactive_butterfly,
+            'bg_alpha': bg_alpha,
+            'overview_avg_xlim': overview_avg_xlim,
+            'psd_method': psd_method,
+            'max_live_pages': max_live_pages,
+            'pixmap_cache_mb': pixmap_cache_mb,
+            'low_memory': low_memory,
+            'source_dtype': source_dtype,
+            'memmap_dir': memmap_dir,
+            'cache_dir': cache_dir,
+            'cache_max_mb': cache_max_mb,
+            'segment_duration': segment_duration,
+            'tfr': tfr,
+            'tfr_freqs': tfr_freqs,
+            'tfr_decim': tfr_decim,
+            'templates': templates,
+            'template_threshold': template_threshold,
+            'journal_dir': journal_dir,
+            'tfr_cache_mb': tfr_cache_mb,
+            'profile': profile,
+        }
+
+        # Sources, statistics, spectra and topomaps (or an ICAData prepared in the background)
+        if data is None:
+            self.setup_data(ica, epochs, apply_baseline)
+        else:
+            self.adopt_data(data)
+
+        # Decisions recorded for this ICA in an earlier (maybe crashed) session
+        self.open_journal()
+
+        # Setting Parameters to Plot Styles and Colors
+        self.plot_style_and_colors()
+
+        # Initializing UI
+        self.current_page = 0
+        self.initUI()
+
+        # Render Scheduler (worker pool, current page first then prefetch)
+        self.scheduler = ICARenderScheduler(self)
+        self.tfr_pool = QThreadPool()
+        self.tfr_pool.setMaxThreadCount(1)
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.request_update)
+
+        # Remaining epochs (and the spectra) are loaded in the background
+        self.load_thread = ICALoadThread(self)
+        self.load_thread.progress_signal.connect(self.loading_progress)
+        self.load_thread.finished_signal.connect(self.loading_finished)
+        if self.loaded:
+            self.refresh_data()
+            self.save_cache()
+        else:
+            self.loading_progress(self.n_loaded)
+            self.load_thread.start()
+
+        # Make UI Pop UP (unless embedded, e.g. in an ICAQueueWindow)
+        if parent is None:
+            self.show()
+            self.activateWindow()
+            self.raise_()
+            self.setWindowState(Qt.WindowActive)
+            self.showMaximized()
+        
+        # Request Update
+        self.request_update()
+        
+    def initUI(self):
+        # Setting up layouts
+        main_layout = QHBoxLayout()
+        left_layout = self.setup_left_layout()
+        right_layout = self.setup_right_layout()
+
+        # Adding layouts to main layout
+        main_layout.addLayout(left_layout)
+        main_layout.addLayout(right_layout)
+
+        # Set the layout
+        self.setLayout(main_layout)
+
+        # Set buttons starting state
+        self.button_left.setEnabled(False)
+        self.button_left.setText('Overview')
+        self.button_right.setText('Single Component Vizualization')
+        self.button_right.setToolTip('Go to single component vizualization')
+
+    def setup_left_layout(self):
+        left_layout = QVBoxLayout()
+
+        # Labels
+        self.good_label = self.create_centered_label('Kept Components')
+        self.bad_label = self.create_centered_label('Removed Components')
+
+        # Component tables (one model, filtered into kept/removed, sortable by metric)
+        self.component_model = ICAComponentModel(self)
+        self.kept_view = self.create_component_view(excluded=False)
+        self.removed_view = self.create_component_view(excluded=True)
+
+        # Buttons
+        self.change_component_button = self.create_button('Remove/Restore [R]', self.change_item, 'R', 'Drop/Restore the selected components\n(Shortcut: R)')
+        self.home_button = self.create_button('Home [H]', self.go_home, 'H', 'Go to the overview page\n(Shortcut: H)')
+        self.show_button = self.create_button('Show [S]', self.show_item, 'S', 'Show the selected component\n(Shortcut: S)')
+        self.save_ica_button = self.create_button('Save ICA', self.save_ica, 'Ctrl+S', 'Save the ICA object\n(Shortcut: Ctrl+S)')
+        self.save_figure_button = self.create_button('Save Figure', self.save_figure, 'Ctrl+Shift+S', 'Save the current figure\n(Shortcut: Ctrl+Shift+S)')
+        self.export_clean_button = self.create_button('Export Cleaned Data', self.export_clean, 'Ctrl+E', 'Save the data with the removed components subtracted\n(Shortcut: Ctrl+E)')
+        self.export_clean_button.setEnabled(self.loaded) # uses the precomputed sources
+        self.clean_thread = None
+        self.template_button = self.create_button('Add Template [T]', self.add_template, 'T', 'Save the selected components (or the current one) to the template library\n(Shortcut: T)')
+        self.stats_button = self.create_button('Stats', self.show_stats, 'Ctrl+P', 'Show timings, cache hit rates and memory\n(Shortcut: Ctrl+P)')
+        self.stats_button.setVisible(self.parameters['profile'])
+        self.stats_panel = None
+        self.sources_button = self.create_button('Browse Sources [B]', self.show_sources, 'B', 'Scroll through the component time courses\n(Shortcut: B)')
+        self.sources_button.setVisible(self.continuous)
+        self.source_browser = None
+
+        # Loading progress (hidden once every epoch is in)
+        self.progress_label = self.create_centered_label('')
+        self.progress_label.hide()
+
+        # Watermark
+        watermark = QLabel("Couto, B.A.N. ICApp (2023).", self)
+        watermark.setStyleSheet("color: rgba(200, 200, 200, 128); font-size: 8px;")
+        watermark.setAlignment(Qt.AlignCenter | Qt.AlignBottom)
+
+        # Add widgets to left layout
+        widgets = [
+            self.good_label,
+            self.kept_view,
+            self.bad_label,
+            self.removed_view,
+            self.change_component_button,
+            self.home_button,
+            self.show_button,
+            self.save_ica_button,
+            self.save_figure_button,
+            self.export_clean_button,
+            self.template_button,
+            self.sources_button,
+            self.stats_button,
+            self.progress_label,
+            watermark]
+        
+        for w in widgets:
+            if isinstance(w, QWidget):
+                w.setMaximumWidth(420)
+                left_layout.addWidget(w)
+            else:
+                left_layout.addLayout(w)
+
+        return left_layout
+
+    def setup_right_layout(self):
+        right_layout = QVBoxLayout()
+
+        # Navigation buttons
+        self.button_left = self.create_button('<', self.go_left, QtGui.QKeySequence(Qt.CTRL + Qt.Key_Left), 'Go to the previous page\n(Shortcut: Ctrl+Left)')
+        self.button_right = self.create_button('>', self.go_right, QtGui.QKeySequence(Qt.CTRL + Qt.Key_Right), 'Go to the next page\n(Shortcut: Ctrl+Right)')
+
+        # Number input
+        self.page_number_input = QLineEdit(self)
+        self.page_number_input.setFixedWidth(50)
+        self.page_number_input.setAlignment(Qt.AlignCenter)
+        self.page_number_input.returnPressed.connect(self.go_to_page)
+
+        # Add navigation widgets to layout
+        nav_button_layout = QHBoxLayout()
+        for widget in [self.button_left, self.page_number_input, self.button_right]:
+            nav_button_layout.addWidget(widget)
+        right_layout.addLayout(nav_button_layout)
+
+        # Pages
+        self.setup_pages()
+
+        # Add stacked widget to layout
+        right_layout.addWidget(self.stacked_widget)
+
+        return right_layout
+
+    def setup_pages(self):
+        # Pages are created when first shown, and at most max_live_pages are kept
+        self.stacked_widget = QStackedWidget()
+        self.page_widgets = {}
+        self.labels = {}
+        self.figures = {}
+        self.canvases = {}
+        self.live_pages = OrderedDict()
+
+        # Overview page
+        self.get_page(0)
+
+    def get_page(self, index):
+        if index not in self.page_widgets:
+            title = 'Overview' if index == 0 else self.ica_labels[index-1]
+            page, label, fig, canvas = self.create_page(title)
+            self.page_widgets[index] = page
+            self.labels[index] = label
+            self.figures[index] = fig
+            self.canvases[index] = canvas
+            self.stacked_widget.addWidget(page)
+        self.live_pages[index] = True
+        self.live_pages.move_to_end(index)
+        self.evict_pages(keep=index)
+        return self.page_widgets[index]
+
+    def evict_pages(self, keep=None):
+        # Least recently used pages are dropped and later rebuilt from the cached
+        # numeric results (spectra, evoked, topomaps), not recomputed
+        for index in list(self.live_pages):
+            if len(self.live_pages) <= self.parameters['max_live_pages']:
+                break
+            page = self.page_widgets[index]
+            if index in (0, keep, self.current_page) or index in self.scheduler.jobs or page is self.stacked_widget.currentWidget():
+                continue
+            self.stacked_widget.removeWidget(page)
+            page.deleteLater()
+            self.figures[index].clear()
+            for pages in [self.page_widgets, self.labels, self.figures, self.canvases, self.live_pages]:
+                del pages[index]
+            self.figure_is_empty[index] = True
+            self.page_versions[index] = None
+
+    def create_page(self, title):
+        page = QWidget()
+        page_layout = QVBoxLayout()
+        label = self.create_centered_label(title)
+        fig = Figure(figsize=(10, 10), layout='constrained')
+        if self.parameters['interactive_butterfly']:
+            canvas = FigureCanvas(fig)
+        else:
+            # Pages are rendered offscreen and shown as images
+            canvas = QLabel()
+            canvas.setAlignment(Qt.AlignCenter)
+            canvas.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        page_layout.addWidget(label)
+        page_layout.addWidget(canvas)
+        page.setLayout(page_layout)
+        page.canvas = canvas
+        return page, label, fig, canvas
+
+    def create_button(self, text, slot, shortcut=None, tooltip=None):
+        btn = QPushButton(text, self)
+        btn.setFocusPolicy(Qt.NoFocus) # keep the focus (and selection) on the component tables
+        btn.clicked.connect(slot)
+        if shortcut is not None:
+            QShortcut(QtGui.QKeySequence(shortcut), self).activated.connect(slot)
+        if tooltip is not None:
+            btn.setToolTip(tooltip)
+        return btn
+
+    def create_centered_label(self, text):
+        label = QLabel(text)
+        label.setAlignment(Qt.AlignCenter)
+        return label
+
+    def create_component_view(self, excluded):
+        view = QTableView()
+        view.setModel(ICAComponentFilter(self.component_model, excluded))
+        view.setSortingEnabled(True)
+        view.sortByColumn(0, Qt.AscendingOrder)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        view.setWordWrap(False)
+
+        # Fixed row heights and sampled column widths keep thousands of rows cheap
+        view.verticalHeader().hide()
+        view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        view.verticalHeader().setDefaultSectionSize(view.fontMetrics().height() + 6)
+        view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        view.horizontalHeader().setResizeContentsPrecision(100)
+        view.doubleClicked.connect(self.component_double_clicked)
+        return view
+
+    def selected_components(self, view):
+        proxy = view.model()
+        return [proxy.mapToSource(index).row() for index in view.selectionModel().selectedRows()]
+
+    def go_home(self):
+        self.page_number_input.setText('Home')
+        self.switch_to_page(0)
+
+    def show_item(self):
+        current_widget = QApplication.focusWidget()
+        if current_widget in [self.kept_view, self.removed_view]:
+            selected = self.selected_components(current_widget)
+            if selected:
+                self.switch_to_page(selected[0] + 1)
+
+    def change_item(self):
+        # Moves every selected component to the other table
+        current_widget = QApplication.focusWidget()
+        if current_widget in [self.kept_view, self.removed_view]:
+            self.move_components(self.selected_components(current_widget),
+                                 excluded=current_widget is self.kept_view)
+
+    def component_double_clicked(self, index):
+        comp = index.model().mapToSource(index).row()
+        self.move_components([comp], excluded=not self.exclude_state.excluded[comp])
+
+    def move_components(self, comps, excluded):
+        changed = self.exclude_state.set_excluded(comps, excluded)
+        if not len(changed):
+            return
+        if self.journal is not None:
+            self.journal.append(changed, excluded)
+        self.component_model.components_changed(changed)
+        self.ica.exclude = self.get_bads()
+        if self.source_browser is not None and self.source_browser.isVisible():
+            self.source_browser.draw_window()
+        self.request_update()
+
+    def go_left(self):
+        current_index = self.current_page
+        if current_index > 0:
+            self.switch_to_page(current_index - 1)
+
+    def go_right(self):
+        current_index = self.current_page
+        if current_index < self.n_components:
+            self.switch_to_page(current_index + 1)
+
+    def go_to_page(self):
+        page_number = self.page_number_input.text()
+        if not page_number.isdigit():
+            return
+        
+        page_number = int(page_number)
+
+        if 0 <= page_number < self.n_components:
+            self.switch_to_page(page_number)
+
+    def switch_to_page(self, i):
+        self.page_number_input.setText(str(i))
+        self.current_page = i
+        if i == 0:
+            self.button_left.setEnabled(False)
+            self.button_left.setText('Overview')
+            self.button_right.setText('Single Component Vizualization')
+            self.button_right.setToolTip('Go to single component vizualization')
+        elif i==1:
+            self.button_left.setEnabled(True)
+            self.button_left.setText('Overview')
+            self.button_left.setToolTip('Go to the overview component')
+            self.button_right.setEnabled(True)
+            self.button_right.setText('Next >')
+            self.button_right.setToolTip('Go to the next component')
+        elif i==self.n_components:
+            self.button_left.setEnabled(True)
+            self.button_left.setText('< Previous')
+            self.button_left.setToolTip('Go to the previous component')
+            self.button_right.setEnabled(False)
+            self.button_right.setText('Last Component')
+        else:
+            self.button_left.setEnabled(True)
+            self.button_left.setText('< Previous')
+            self.button_left.setToolTip('Go to the previous component')
+            self.button_right.setEnabled(True)
+            self.button_right.setText('Next >')
+            self.button_right.setToolTip('Go to the next component')
+        self.request_update()
+
+    def request_update(self):
+        # Current page first, then the neighbours and the selected components
+        index = self.current_page
+        pages = [index, index + 1, index - 1]
+        selected = self.selected_components(self.kept_view) + self.selected_components(self.removed_view)
+        for comp in selected[:4]: # prefetch a few, not a whole bulk selection
+            pages.append(comp + 1)
+
+        self.scheduler.request(pages, self.render_size(), self.render_dpi())
+        self.schedule_time_frequency(pages)
+
+    def schedule_time_frequency(self, pages):
+        # ERSP/ITC of the wanted component pages, in the same order
+        if self.time_frequency is None or not self.loaded:
+            return
+        self.tfr_pool.clear()
+        comps = [page - 1 for page in pages if 1 <= page <= self.n_components]
+        for priority, comp in enumerate(comps):
+            if not self.time_frequency.ready(comp):
+                job = ICATimeFrequencyJob(self, comp)
+                job.signals.finished.connect(self.time_frequency_finished)
+                self.tfr_pool.start(job, len(comps) - priority)
+
+    def time_frequency_finished(self, data):
+        if data['comp'] + 1 in self.scheduler.wanted[0]:
+            self.request_update()
+
+    def component_tfr(self, comp):
+        # Only what is already computed; the render jobs never wait for it
+        return self.time_frequency.get(comp)
+
+    def render_size(self):
+        if self.parameters['interactive_butterfly']:
+            return None
+        view = self.stacked_widget.currentWidget().canvas
+        ratio = view.devicePixelRatioF()
+        return (max(int(view.width() * ratio), 1), max(int(view.height() * ratio), 1))
+
+    def render_dpi(self):
+        return 100 * self.devicePixelRatioF()
+
+    def show_page_image(self, index, pixmap):
+        if pixmap is None:
+            self.canvases[index].draw_idle()
+        else:
+            self.canvases[index].setPixmap(pixmap)
+
+        # Only finished pages are swapped in
+        if index == self.current_page:
+            self.stacked_widget.setCurrentWidget(self.page_widgets[index])
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if hasattr(self, 'resize_timer'):
+            self.resize_timer.start()
+
+    def get_bads(self):
+        return self.exclude_state.exclude
+
+    def plot_style_and_colors(self):
+        palette = QApplication.palette()
+        bg_color = palette.color(QtGui.QPalette.Background)
+        text_color = palette.color(QtGui.QPalette.WindowText)
+        self.setup_style(text_color.name(), bg_color.name())
+
+    def save_figure(self):
+        # Get Index
+        index = self.current_page
+        self.scheduler.pool.waitForDone() # the page may still be rendering
+
+        # The page may have been shown from the bitmap cache only
+        self.get_page(index)
+        self.scheduler.renderer.render(self.figures[index], index, self.scheduler.snapshot())
+
+        # Get the current figure and canvas
+        fig = self.figures[index]
+
+        # Save the figure
+        options = QFileDialog.Options()
+        fileName, _ = QFileDialog.getSaveFileName(self, "Save Figure", "", "PNG Files (*.png);;JPEG Files (*.jpg);; SVG Files (*.svg);;All Files (*)", options=options)
+        if fileName:
+            fig.savefig(fileName)
+
+    def save_ica(self):
+        # Save the figure
+        options = QFileDialog.Options()
+        fileName, _ = QFileDialog.getSaveFileName(self, "Save ICA", "", "ICA Files (*-ica.fif);;;;All Files (*)", options=options)
+        if fileName:
+            if not fileName.endswith('-ica.fif'):
+                fileName += '-ica.fif'
+            self.ica.save(fileName, overwrite=True)
+            if self.journal is not None:
+                self.journal.saved(self.ica.exclude)
+
+    def export_clean(self):
+        if self.clean_thread is not None and self.clean_thread.isRunning():
+            return
+        options = QFileDialog.Options()
+        suffix = '_raw.fif' if self.continuous else '-epo.fif'
+        fileName, _ = QFileDialog.getSaveFileName(self, "Export Cleaned Data", "", f"FIF Files (*{suffix});;NumPy Files (*.npy);;All Files (*)", options=options)
+        if fileName:
+            if not fileName.endswith(('.fif', '.fif.gz', '.npy')):
+                fileName += suffix
+            self.export_clean_button.setEnabled(False)
+            self.clean_thread = ICACleanThread(self, fileName, list(self.exclude_state.exclude))
+            self.clean_thread.progress_signal.connect(self.clean_progress)
+            self.clean_thread.finished_signal.connect(self.clean_finished)
+            self.clean_progress(0, 1)
+            self.clean_thread.start()
+
+    def add_template(self):
+        # Labels the selected components (or the one on screen) in the template
+        # library, as kept or removed like they are now
+        comps = self.selected_components(self.kept_view) + self.selected_components(self.removed_view)
+        if not comps and self.current_page > 0:
+            comps = [self.current_page - 1]
+        if not comps:
+            return
+        if self.template_library is None:
+            options = QFileDialog.Options()
+            fileName, _ = QFileDialog.getSaveFileName(self, "Template Library", "", "Template Libraries (*.npz);;All Files (*)", options=options)
+            if not fileName:
+                return
+            if not fileName.endswith('.npz'):
+                fileName += '.npz'
+            self.template_library = ICATemplateLibrary(fileName)
+        label, ok = QInputDialog.getText(self, 'Add Template', f'Label for {len(comps)} component(s):')
+        label = label.strip()
+        if not ok or not label:
+            return
+        spectra = self.spectra_sum / max(self.n_loaded, 1)
+        for excluded in [True, False]:
+            group = [comp for comp in comps if self.exclude_state.excluded[comp] == excluded]
+            if group:
+                self.template_library.add_ica(self.ica, group, label, excluded, spectra, self.spectra.freqs)
+                for comp in group:
+                    self.template_matches[comp] = (label, 1., excluded)
+        self.template_library.save()
+        self.component_model.metrics_changed()
+
+    def clean_progress(self, n_done, n_total):
+        self.progress_label.setText(f'Exporting cleaned data\n{100 * n_done // n_total}%')
+        self.progress_label.show()
+
+    def clean_finished(self, data):
+        self.progress_label.hide()
+        self.export_clean_button.setEnabled(True)
+        if 'error' in data:
+            print(f"Export of the cleaned data failed: {data['error']!r}")
+
+    def refresh_data(self):
+        ICAData.refresh_data(self)
+        self.component_model.metrics_changed()
+
+    def cache_stats(self):
+        stats = ICAData.cache_stats(self)
+        stats['pixmap_cache'] = (self.scheduler.cache.hits, self.scheduler.cache.misses)
+        return stats
+
+    def show_sources(self):
+        if not self.continuous:
+            return
+        if self.source_browser is None:
+            self.source_browser = ICASourceBrowser(self)
+        self.source_browser.show()
+        self.source_browser.raise_()
+
+    def show_stats(self):
+        if self.stats_panel is None:
+            self.stats_panel = ICAStatsPanel(self)
+        self.stats_panel.show()
+        self.stats_panel.raise_()
+
+    def loading_progress(self, n_loaded):
+        self.progress_label.setText(f'Loading epochs\n{n_loaded}/{len(self.epochs)}')
+        self.progress_label.show()
+
+    def loading_finished(self, data):
+        self.progress_label.hide()
+        if data['loaded']:
+            self.export_clean_button.setEnabled(True)
+            self.refresh_data()
+            self.request_update()
+
+    def closeEvent(self, event):
+        self.load_thread.cancelled = True
+        self.load_thread.wait()
+        if self.clean_thread is not None:
+            if self.clean_writer is not None:
+                self.clean_writer.cancelled = True # the partial file is removed
+            self.clean_thread.wait()
+        self.tfr_pool.clear()
+        self.tfr_pool.waitForDone()
+        self.scheduler.shutdown()
+        if self.stats_panel is not None:
+            self.stats_panel.close()
+        if self.source_browser is not None:
+            self.source_browser.close()
+        plt.close('all')
+        self.ica.exclude = self.get_bads()
+        self.returnValue = self.ica
+        event.accept()
+
+class ICAQueueWindow(QWidget):
+    # Reviews a sequence of subjects in one window. The first one loads like a
+    # plain ICApp, every following one is prepared by an ICAPreloadThread while
+    # the previous one is on screen, so Next Subject usually swaps instantly
+    def __init__(self, subjects, save_dir=None, on_done=None, apply_baseline=True, **kwargs):
+        super().__init__()
+        self.setWindowTitle('ICApp')
+        self.subjects = iter(subjects)
+        self.save_dir = save_dir
+        self.on_done = on_done
+        self.apply_baseline = apply_baseline
+        self.kwargs = kwargs
+        self.results = OrderedDict()
+        if save_dir is not None:
+            os.makedirs(save_dir, exist_ok=True)
+
+        # Queue state
+        self.app = None
+        self.name = None
+        self.n_taken = 0
+        self.pending = None
+        self.waiting = False
+        self.preload_thread = None
+
+        # Header (subject, preload status, next) above the embedded application
+        self.subject_label = QLabel('')
+        self.subject_label.setStyleSheet('font-weight: bold')
+        self.status_label = QLabel('')
+        self.next_button = QPushButton('Next Subject [Ctrl+N]')
+        self.next_button.setFocusPolicy(Qt.NoFocus)
+        self.next_button.clicked.connect(self.next_subject)
+        QShortcut(QtGui.QKeySequence('Ctrl+N'), self).activated.connect(self.next_subject)
+        header = QHBoxLayout()
+        header.addWidget(self.subject_label)
+        header.addStretch(1)
+        header.addWidget(self.status_label)
+        header.addWidget(self.next_button)
+        self.app_layout = QVBoxLayout()
+        layout = QVBoxLayout()
+        layout.addLayout(header)
+        layout.addLayout(self.app_layout, 1)
+        self.setLayout(layout)
+
+        self.show()
+        self.activateWindow()
+        self.raise_()
+        self.showMaximized()
+
+        # First subject in the foreground (its own loader streams the epochs)
+        item = next(self.subjects, None)
+        if item is None:
+            QTimer.singleShot(0, self.close)
+            return
+        name, ica, inst = read_subject(item, 0)
+        self.n_taken = 1
+        self.show_subject(name, ica, inst)
+
+    def show_subject(self, name, ica, inst, data=None):
+        self.name = name
+        self.app = ICA_Application(ica, inst, apply_baseline=self.apply_baseline, data=data, parent=self, **self.kwargs)
+        self.app_layout.addWidget(self.app)
+        self.subject_label.setText(f'Subject {self.n_taken}: {name}')
+        self.setWindowTitle(f'ICApp - {name}')
+        self.app.setFocus()
+        self.preload_next()
+
+    def preload_next(self):
+        self.pending = None
+        self.next_button.setText('Next Subject [Ctrl+N]')
+        self.status_label.setText('Preparing next subject...')
+        self.preload_thread = ICAPreloadThread(self.subjects, self.n_taken, self.app.parameters, self.apply_baseline)
+        self.preload_thread.finished_signal.connect(self.preload_finished)
+        self.preload_thread.start()
+
+    def preload_finished(self, data):
+        if self.sender() is not self.preload_thread or self.preload_thread.cancelled:
+            return
+        if data['done']:
+            self.status_label.setText('Last subject')
+            self.next_button.setText('Finish [Ctrl+N]')
+        elif 'error' in data:
+            # Unreadable entry: report it and prepare the one after instead
+            self.n_taken += 1
+            print(f"ICApp queue: skipping {data['name']} ({data['error']!r})")
+            self.preload_thread = ICAPreloadThread(self.subjects, self.n_taken, self.app.parameters, self.apply_baseline)
+            self.preload_thread.finished_signal.connect(self.preload_finished)
+            self.preload_thread.start()
+            return
+        else:
+            self.status_label.setText(f"Next: {data['name']} (ready)")
+        self.pending = data
+        if self.waiting:
+            self.next_subject()
+
+    def finish_subject(self):
+        # Closing the embedded application stores its decisions in ica.exclude
+        app, self.app = self.app, None
+        app.close()
+        ica = app.returnValue
+        self.results[self.name] = ica
+        if self.save_dir is not None:
+            ica.save(os.path.join(self.save_dir, f'{self.name}-ica.fif'), overwrite=True, verbose=False)
+            if app.journal is not None:
+                app.journal.saved(ica.exclude)
+        if self.on_done is not None:
+            self.on_done(self.name, ica)
+        self.app_layout.removeWidget(app)
+        app.deleteLater()
+
+    def next_subject(self):
+        if self.app is not None:
+            self.finish_subject()
+        if self.pending is None:
+            # Not prepared yet: show it as soon as the preload thread is done
+            self.waiting = True
+            self.subject_label.setText('Loading next subject...')
+            return
+        self.waiting = False
+        data, self.pending = self.pending, None
+        if data['done']:
+            self.close()
+            return
+        self.n_taken += 1
+        self.show_subject(data['name'], data['ica'], data['inst'], data['data'])
+
+    def closeEvent(self, event):
+        if self.app is not None:
+            self.finish_subject()
+        if self.preload_thread is not None:
+            self.preload_thread.cancelled = True
+            self.preload_thread.wait()
+        event.accept()